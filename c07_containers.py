@@ -8,7 +8,12 @@
 # -------------------------------- DEFINITIONS --------------------------------
 
 
-class WDict:
+import collections
+import functools
+import itertools
+
+
+class WDict(dict):
     """Basic dictionary wrapper class."""
 
     # About container classes
@@ -17,78 +22,1583 @@ class WDict:
     # redefine container-specific special methods such as:
     # __contains__, __len__, __getitem__, __setitem__, __delitem__, etc.
 
-
-    def __init__(self): # Initializer
-        """Creates WDict instance."""
-
-        print("DEBUG: creating WDict instance.") # DEBUG
-        self._dictattr = dict() # object contains only a dictionary
-            # Uses dict() method of class *dict*.
+    # About performance
+    # -----------------
+    # A first version of this class stored a dictionary in an attribute and
+    # redefined all the methods above to call the methods of that dictionary
+    # (printing a DEBUG line each time). Each operation then costs a Python
+    # method call on top of the dictionary operation, which makes it much
+    # slower than a plain 'dict'.
+    # Here we inherit from class *dict* instead, so item access goes straight
+    # to the (C) methods of class *dict*. Container methods are redefined in
+    # subclass _TracedWDict, which instances only use while a tracer is
+    # attached (see set_tracer() below). So tracing costs nothing when off.
 
 
-    def __del__(self): # Finalizer
-        """Deletes WDict instance."""
-        # Educational but not very useful here.
+    def __init__(self, *args, **kwargs): # Initializer
+        """Creates WDict instance. Takes the same arguments as dict()."""
 
-        print("DEBUG: deleting WDict instance.") # DEBUG
-        self._dictattr.clear() # deletes all items. 
-            # Uses clear() method of class *dict*.
+        super().__init__(*args, **kwargs) # uses initializer of class *dict*
+        self._tracer = None
 
 
     def __repr__(self): # Representation
             """Returns a detailed string representation of the WDict."""
             # We could define __str__ as well, but it is not mandatory.
 
-            return "WDict: _dictattr = {}".format(repr(self._dictattr))
+            return "WDict: {}".format(dict.__repr__(self))
                 # Uses __repr__() method of class *dict*.
+                # NB: repr(self) would call this method again (forever!).
+
+
+    @property
+    def _dictattr(self):
+        """Dictionary holding items (the WDict itself)."""
+        # Kept for code written against the first version of this class.
+
+        return self
+
+
+    def set_tracer(self, tracer):
+        """Attaches given tracer to calling WDict instance, or detaches
+        current tracer if given tracer is None.
+        The tracer is called as 'tracer(operation, key)' on each item access,
+        'operation' being one of: 'get', 'set', 'del', 'contains'."""
+
+        self._tracer = tracer
+        untraced = getattr(type(self), "_untraced", type(self))
+        self.__class__ = untraced if tracer is None else _traced(untraced)
+            # Changes the class of the instance (and so its methods) on
+            # the fly. Allowed here as both classes have the same layout.
+
+    # About bulk operations
+    # ---------------------
+    # Methods below process a whole batch of items in a single call. Loops
+    # over the batch then run in C code (in dict.update(), map(), etc.),
+    # instead of paying for one Python-level operation per item.
+
+
+    @classmethod
+    def from_items(cls, items):
+        """Creates instance from given (key, value) pairs, or mapping."""
+        # A class method receives the class ('cls') instead of an instance,
+        # so that subclasses create instances of their own class.
+
+        return cls(items)
+
+
+    def set_many(self, items):
+        """Sets items from given (key, value) pairs, or mapping."""
+
+        dict.update(self, items)
+
+
+    def get_many(self, keys, default=None):
+        """Returns the list of items which keys are given (default value for
+        missing keys)."""
+
+        return list(map(self.get, keys, itertools.repeat(default)))
+
+
+    def delete_many(self, keys):
+        """Deletes items which keys are given. If a key is missing, no item
+        is deleted."""
+
+        keys = list(dict.fromkeys(keys)) # drops duplicates, keeps order
+        for key in itertools.filterfalse(dict.__contains__.__get__(self), keys):
+            raise KeyError(key) # first missing key (checked in C code)
+        collections.deque(map(self.pop, keys), maxlen=0)
+            # Consumes the iterator in C code, storing nothing.
+
+
+
+class _TracedWDict(WDict):
+    """WDict with a tracer attached (see WDict.set_tracer)."""
+
+    # Methods below call the tracer, then the method of the next class in the
+    # MRO, so that they also work on top of subclasses of WDict (see _traced).
+
+    _untraced = WDict # class to go back to when the tracer is detached
 
 
     def __getitem__(self, key): # Item getter
         """Returns item which key is given."""
         # Called, for instance, by *obj = instance[key]* statements.
 
-        print("DEBUG: getting item '{}'.".format(key)) # DEBUG
-        return self._dictattr[key]
-            # Uses __getitem__ method of class *dict*.
-            # Equivalent to self._dictattr.__getitem__(key).
+        self._tracer("get", key)
+        return super().__getitem__(key)
+            # Uses __getitem__ method of class *dict* (for a WDict).
 
 
     def __setitem__(self, key, value): # Item setter
         """Sets item which key is given to given value."""
         # Called by *instance[key] = value* statements.
 
-        print("DEBUG: setting item '{}'.".format(key)) # DEBUG
-        self._dictattr[key] = value
-            # Uses __setitem__ method of class *dict*.
-            # Equivalent to self._dictattr.__setitem__(key, value).
+        self._tracer("set", key)
+        super().__setitem__(key, value)
+            # Uses __setitem__ method of class *dict* (for a WDict).
 
 
     def __delitem__(self, key): # Item deleter
         """Deletes item whick key is given."""
         # Called by *del instance[key]* statements.
 
-        print("DEBUG: deleting item '{}'.".format(key)) # DEBUG
-        del self._dictattr[key]
-            # Uses __delitem__ method of class *dict*.
-            # Equivalent to dict.__delitem__(self._dictattr, key).
+        self._tracer("del", key)
+        super().__delitem__(key)
+            # Uses __delitem__ method of class *dict* (for a WDict).
 
 
     def __contains__(self, key): # Item finder
         """Returns True if given key exists, else False."""
         # Called by *key in instance* statements.
 
-        print("DEBUG: looking for key '{}'.".format(key)) # DEBUG
-        return (key in self._dictattr)
-            # Uses __contains__ method of class *dict*.
-            # Equivalent to dict.__contains__(self._dictattr, key).
+        self._tracer("contains", key)
+        return super().__contains__(key)
+            # Uses __contains__ method of class *dict* (for a WDict).
+
+
+    def __reduce__(self):
+        """Returns how to pickle calling instance: as an instance of the
+        untraced class, without its tracer."""
+        # Unpickling sets items before attributes, so the traced methods
+        # would be called before attribute '_tracer' is restored.
+
+        state = dict(self.__dict__, _tracer=None)
+        return (self._untraced, (), state, None, iter(dict.items(self)))
+
+
+    def update(self, *args, **kwargs):
+        """Updates items, like dict.update()."""
+
+        self.set_many(dict(*args, **kwargs))
+
+
+    def set_many(self, items):
+        """Sets items from given (key, value) pairs, or mapping."""
+
+        items = dict(items)
+        for key in items:
+            self._tracer("set", key)
+        super().set_many(items)
+
+
+    def get_many(self, keys, default=None):
+        """Returns the list of items which keys are given (default value for
+        missing keys)."""
+
+        keys = list(keys)
+        for key in keys:
+            self._tracer("get", key)
+        return super().get_many(keys, default)
+
+
+    def delete_many(self, keys):
+        """Deletes items which keys are given."""
+
+        keys = list(dict.fromkeys(keys))
+        for key in keys:
+            self._tracer("del", key)
+        super().delete_many(keys)
+
+
+
+_TRACED_CLASSES = {WDict: _TracedWDict} # class -> its traced version
+
+
+def _traced(cls):
+    """Returns traced version of given subclass of WDict (built on first
+    call, then cached)."""
+
+    if cls not in _TRACED_CLASSES:
+        _TRACED_CLASSES[cls] = type("_Traced" + cls.__name__,
+                                    (_TracedWDict, cls), {"_untraced": cls})
+            # Same as a 'class' statement: name, base classes, attributes.
+    return _TRACED_CLASSES[cls]
+
+
+
+# --------------------------------- TRACERS -----------------------------------
+
+
+def print_tracer(operation, key):
+    """Tracer printing a DEBUG line for each operation."""
+
+    verbs = {"get": "getting item", "set": "setting item",
+             "del": "deleting item", "contains": "looking for key"}
+    print("DEBUG: {} '{}'.".format(verbs[operation], key))
+
+
+
+class OpCounter:
+    """Tracer counting operations, and optionally keeping a sample of
+    them (one operation out of 'every', 'keep' samples at most)."""
+
+
+    def __init__(self, every=0, keep=100):
+        """Creates OpCounter instance."""
+
+        self.counts = dict.fromkeys(("get", "set", "del", "contains"), 0)
+            # Operation -> number of calls
+        self.samples = collections.deque(maxlen=keep) # (operation, key)
+        self._every = every
+        self._total = 0
+
+
+    def __call__(self, operation, key):
+        """Records given operation."""
+        # Defining __call__ makes instances callable, like functions.
+
+        self.counts[operation] += 1
+        self._total += 1
+        if self._every and self._total % self._every == 0:
+            self.samples.append((operation, key))
+
+
+    def __repr__(self):
+        """Returns string representation of calling OpCounter instance."""
+
+        return "OpCounter: counts = {}".format(self.counts)
+
+
+
+# ---------------------------------- CACHE ------------------------------------
+
+
+import sys
+import time
+
+
+class _LRUPolicy:
+    """Least Recently Used eviction policy (internal use only)."""
+
+    # Keys are kept in an ordered dictionary, from least to most recently
+    # used, so that all operations run in O(1).
+
+
+    def __init__(self):
+        """Creates _LRUPolicy instance."""
+
+        self._order = collections.OrderedDict() # key -> None
+
+
+    def add(self, key):
+        """Registers given (new) key."""
+
+        self._order[key] = None
+
+
+    def touch(self, key):
+        """Registers an access to given key."""
+
+        self._order.move_to_end(key)
+
+
+    def remove(self, key):
+        """Unregisters given key."""
+
+        del self._order[key]
+
+
+    def victim(self):
+        """Returns the key to be evicted first."""
+
+        return next(iter(self._order))
+
+
+
+class _LFUPolicy:
+    """Least Frequently Used eviction policy (internal use only). Among keys
+    used the same number of times, the least recently used goes first."""
+
+    # Keys are kept in "buckets" (one per access count), each bucket being an
+    # ordered dictionary (like in _LRUPolicy). Counts of non-empty buckets
+    # are chained in increasing order (a doubly linked list made of two
+    # dictionaries), so that the lowest count is always known and all
+    # operations run in O(1): a touched key only moves to the next count.
+
+
+    def __init__(self):
+        """Creates _LFUPolicy instance."""
+
+        self._counts = dict() # key -> access count
+        self._buckets = dict() # access count -> OrderedDict of keys
+        self._next = dict() # access count -> next higher count (or None)
+        self._prev = dict() # access count -> next lower count (or None)
+        self._lowest = None # lowest count
+
+
+    def _link(self, count, after):
+        """Creates bucket for given count, right after given count (None to
+        make it the lowest one)."""
+
+        self._buckets[count] = collections.OrderedDict()
+        following = self._lowest if after is None else self._next[after]
+        self._prev[count] = after
+        self._next[count] = following
+        if after is None:
+            self._lowest = count
+        else:
+            self._next[after] = count
+        if following is not None:
+            self._prev[following] = count
+
+
+    def _unlink(self, count):
+        """Deletes (empty) bucket for given count."""
+
+        del self._buckets[count]
+        previous = self._prev.pop(count)
+        following = self._next.pop(count)
+        if previous is None:
+            self._lowest = following
+        else:
+            self._next[previous] = following
+        if following is not None:
+            self._prev[following] = previous
+
+
+    def add(self, key):
+        """Registers given (new) key."""
+
+        if 1 not in self._buckets:
+            self._link(1, None) # 1 is the lowest possible count
+        self._counts[key] = 1
+        self._buckets[1][key] = None
+
+
+    def touch(self, key):
+        """Registers an access to given key."""
+
+        count = self._counts[key]
+        if count + 1 not in self._buckets:
+            self._link(count + 1, count)
+        self._buckets[count + 1][key] = None
+        self._counts[key] = count + 1
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            self._unlink(count)
+
+
+    def remove(self, key):
+        """Unregisters given key."""
+
+        count = self._counts.pop(key)
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            self._unlink(count)
+
+
+    def victim(self):
+        """Returns the key to be evicted first."""
+
+        return next(iter(self._buckets[self._lowest]))
+
+
+
+class CacheWDict:
+    """Dictionary wrapper class with a bounded size, which evicts items
+    according to given policy ('lru' or 'lfu') and optionally expires them
+    after a time-to-live (in seconds)."""
+
+    # About eviction
+    # --------------
+    # Items are evicted as soon as a limit is exceeded, by the method which
+    # inserts them. We do NOT rely on a finalizer (__del__) for this, as we do
+    # not control when finalizers are called.
+    # Expired items are removed when they are accessed, or evicted when room
+    # is needed, so they may still be counted by len() until then. Method
+    # purge() removes all of them at once.
+
+    POLICIES = {"lru": _LRUPolicy, "lfu": _LFUPolicy}
+
+
+    def __init__(self, maxitems=None, maxbytes=None, policy="lru", ttl=None,
+                 sizeof=sys.getsizeof, clock=time.monotonic):
+        """Creates CacheWDict instance. Size of items is computed by function
+        'sizeof' (only if 'maxbytes' is set), time is given by 'clock'."""
+
+        if policy not in self.POLICIES: # check input
+            raise ValueError("unknown policy '{}'".format(policy))
+
+        self._dictattr = dict() # key -> [value, expiry time, size]
+        self._policy = self.POLICIES[policy]()
+        self._maxitems = maxitems
+        self._maxbytes = maxbytes
+        self._ttl = ttl
+        self._sizeof = sizeof
+        self._clock = clock
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+
+    def __repr__(self): # Representation
+        """Returns a detailed string representation of the CacheWDict."""
+
+        items = {key: entry[0] for (key, entry) in self._dictattr.items()}
+        return "CacheWDict: {}".format(items)
+
+
+    def __getitem__(self, key): # Item getter
+        """Returns item which key is given, if it has not expired."""
+
+        entry = self._dictattr.get(key) # entries are never None
+        if entry is None:
+            self.misses += 1
+            raise KeyError(key)
+        if entry[1] is not None and entry[1] <= self._clock():
+            self._discard(key)
+            self.expirations += 1
+            self.misses += 1
+            raise KeyError(key)
+
+        self.hits += 1
+        self._policy.touch(key)
+        return entry[0]
+
+
+    def get(self, key, default=None):
+        """Returns item which key is given, or default value if there is
+        no such item (or if it has expired)."""
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def __setitem__(self, key, value): # Item setter
+        """Sets item which key is given to given value (with default
+        time-to-live)."""
+
+        self.set(key, value)
+
+
+    def set(self, key, value, ttl=None):
+        """Sets item which key is given to given value, expiring after given
+        time-to-live (default time-to-live if None)."""
+
+        self._insert(key, value, self._expiry(ttl))
+
+
+    def _expiry(self, ttl):
+        """Returns expiry time for given time-to-live (internal use only)."""
+
+        if ttl is None:
+            ttl = self._ttl
+        return None if ttl is None else self._clock() + ttl
+
+
+    def _insert(self, key, value, expiry):
+        """Sets item which key is given (internal use only)."""
+
+        size = 0 if self._maxbytes is None else self._sizeof(value)
+        if self._maxbytes is not None and size > self._maxbytes:
+            raise ValueError("item is larger than maximum size")
+
+        entry = self._dictattr.get(key)
+        if entry is not None: # overwriting: the old value no longer counts
+            self._nbytes -= entry[2]
+            entry[2] = 0
+        self._evict(key, size) # makes room BEFORE inserting: a new item
+            # would otherwise be the first one to go with the 'lfu' policy
+
+        entry = self._dictattr.get(key) # may have been evicted
+        if entry is None:
+            self._dictattr[key] = [value, expiry, size]
+            self._policy.add(key)
+        else:
+            entry[:] = [value, expiry, size]
+            self._policy.touch(key) # keeps (and increments) its count
+        self._nbytes += size
+
+
+    def __delitem__(self, key): # Item deleter
+        """Deletes item which key is given."""
+
+        if key not in self._dictattr:
+            raise KeyError(key)
+        self._discard(key)
+
+
+    def __contains__(self, key): # Item finder
+        """Returns True if given key exists and has not expired, else False.
+        Does not count as an access."""
+
+        entry = self._dictattr.get(key)
+        return (entry is not None
+                and (entry[1] is None or entry[1] > self._clock()))
 
 
     def __len__(self): # Length
-        """Returns the length of the calling WDict instance."""
-        
+        """Returns the number of items (including expired items which have
+        not been removed yet)."""
+
         return len(self._dictattr)
-            # Uses __len__ method of class *dict*.
-            # Equivalent to dict.__len__(self._dictattr)
+
+
+    def __iter__(self):
+        """Iterates over keys which have not expired. Does not count as
+        accesses."""
+        # Without this method, Python would iterate by calling __getitem__
+        # with indexes 0, 1, 2, etc. until it raises an IndexError.
+
+        now = self._clock()
+        keys = [key for (key, entry) in self._dictattr.items()
+                if entry[1] is None or entry[1] > now] # copy: safe to modify
+        return iter(keys)                              # cache while iterating
+
+
+    def _discard(self, key):
+        """Removes item which key is given (internal use only)."""
+
+        entry = self._dictattr.pop(key)
+        self._policy.remove(key)
+        self._nbytes -= entry[2]
+
+
+    def _evict(self, key, size):
+        """Evicts items until there is room to set item which key is given,
+        of given size (internal use only)."""
+
+        while self._dictattr and (
+                (self._maxitems is not None and key not in self._dictattr
+                    and len(self._dictattr) >= self._maxitems)
+                or (self._maxbytes is not None
+                    and self._nbytes + size > self._maxbytes)):
+            victim = self._policy.victim()
+            expiry = self._dictattr[victim][1]
+            if expiry is not None and expiry <= self._clock():
+                self.expirations += 1
+            else:
+                self.evictions += 1
+            self._discard(victim)
+
+
+    @classmethod
+    def from_items(cls, items, **options):
+        """Creates instance from given (key, value) pairs, or mapping.
+        Other arguments are passed to the initializer."""
+
+        cache = cls(**options)
+        cache.set_many(items)
+        return cache
+
+
+    def set_many(self, items, ttl=None):
+        """Sets items from given (key, value) pairs, or mapping, all of them
+        expiring after given time-to-live (default time-to-live if None)."""
+
+        if hasattr(items, "items"): # mapping
+            items = items.items()
+        expiry = self._expiry(ttl) # reads the clock only once
+        insert = self._insert # looks up the method only once
+        for (key, value) in items:
+            insert(key, value, expiry)
+
+
+    def update(self, items):
+        """Sets items from given (key, value) pairs, or mapping."""
+
+        self.set_many(items)
+
+
+    def get_many(self, keys, default=None):
+        """Returns the list of items which keys are given (default value for
+        missing or expired keys)."""
+
+        now = self._clock()
+        (entries, touch) = (self._dictattr, self._policy.touch)
+        values = []
+        for key in keys:
+            entry = entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= now:
+                self._discard(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                values.append(default)
+            else:
+                self.hits += 1
+                touch(key)
+                values.append(entry[0])
+        return values
+
+
+    def delete_many(self, keys):
+        """Deletes items which keys are given. If a key is missing, no item
+        is deleted."""
+
+        keys = list(dict.fromkeys(keys)) # drops duplicates, keeps order
+        for key in keys:
+            if key not in self._dictattr:
+                raise KeyError(key)
+        for key in keys:
+            self._discard(key)
+
+
+    def purge(self):
+        """Removes all expired items. Runs in O(n)."""
+
+        now = self._clock()
+        expired = [key for (key, entry) in self._dictattr.items()
+                   if entry[1] is not None and entry[1] <= now]
+        for key in expired:
+            self._discard(key)
+        self.expirations += len(expired)
+
+
+    def stats(self):
+        """Returns counters as a dictionary."""
+
+        return {"items": len(self._dictattr), "bytes": self._nbytes,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "expirations": self.expirations}
+
+
+
+# --------------------------------- SHARDED -----------------------------------
+
+
+import contextlib
+import threading
+
+
+class ShardedWDict:
+    """Thread-safe dictionary wrapper class. Keys are spread over several
+    dictionaries ("shards"), each one protected by its own lock."""
+
+    # About locks
+    # -----------
+    # With a single lock, threads accessing different keys still have to wait
+    # for each other. Here a thread only locks the shard holding its key, so
+    # threads only wait for each other when their keys are in the same shard.
+    # Iterating does not lock the whole container: each shard is copied in
+    # turn, so the result is "weakly consistent" (it may miss changes made
+    # to shards which were already copied).
+
+
+    def __init__(self, nshards=16):
+        """Creates ShardedWDict instance."""
+
+        if nshards < 1: # check input
+            raise ValueError("nshards must be positive")
+        self._shards = [dict() for _ in range(nshards)]
+        self._locks = [threading.Lock() for _ in range(nshards)]
+
+
+    def _index(self, key):
+        """Returns index of the shard holding given key."""
+
+        return hash(key) % len(self._shards)
+
+
+    def __repr__(self): # Representation
+        """Returns a detailed string representation of the ShardedWDict."""
+
+        return "ShardedWDict: {}".format(dict(self.items()))
+
+
+    def __getitem__(self, key): # Item getter
+        """Returns item which key is given."""
+
+        idx = self._index(key)
+        with self._locks[idx]: # lock is released when leaving the context
+            return self._shards[idx][key]
+
+
+    def get(self, key, default=None):
+        """Returns item which key is given, or default value if there is
+        no such item."""
+
+        idx = self._index(key)
+        with self._locks[idx]:
+            return self._shards[idx].get(key, default)
+
+
+    def __setitem__(self, key, value): # Item setter
+        """Sets item which key is given to given value."""
+
+        idx = self._index(key)
+        with self._locks[idx]:
+            self._shards[idx][key] = value
+
+
+    def __delitem__(self, key): # Item deleter
+        """Deletes item which key is given."""
+
+        idx = self._index(key)
+        with self._locks[idx]:
+            del self._shards[idx][key]
+
+
+    def __contains__(self, key): # Item finder
+        """Returns True if given key exists, else False."""
+
+        idx = self._index(key)
+        with self._locks[idx]:
+            return key in self._shards[idx]
+
+
+    def __len__(self): # Length
+        """Returns the number of items (weakly consistent)."""
+
+        count = 0
+        for (shard, lock) in zip(self._shards, self._locks):
+            with lock:
+                count += len(shard)
+        return count
+
+
+    def setdefault(self, key, default=None):
+        """Returns item which key is given. If there is no such item, sets it
+        to given default value first. Atomic."""
+
+        idx = self._index(key)
+        with self._locks[idx]:
+            return self._shards[idx].setdefault(key, default)
+
+
+    def get_or_set(self, key, factory):
+        """Returns item which key is given. If there is no such item, sets it
+        to the value returned by 'factory()' first. Atomic.
+        NB: The shard is locked while 'factory' runs, so it should be fast."""
+
+        idx = self._index(key)
+        with self._locks[idx]:
+            shard = self._shards[idx]
+            if key in shard:
+                return shard[key]
+            value = shard[key] = factory()
+            return value
+
+
+    @contextlib.contextmanager
+    def _locked(self, indexes):
+        """Context in which locks of shards which indexes are given are held
+        (internal use only)."""
+        # Locks are always acquired in the same order (by increasing index),
+        # so that two threads can never wait for each other forever.
+
+        indexes = sorted(indexes)
+        for idx in indexes:
+            self._locks[idx].acquire()
+        try:
+            yield
+        finally:
+            for idx in reversed(indexes):
+                self._locks[idx].release()
+
+
+    def update_many(self, items):
+        """Sets items from given (key, value) pairs, or mapping. Atomic: other
+        threads see either none or all of the new items."""
+
+        if hasattr(items, "items"): # mapping
+            items = items.items()
+        groups = dict() # shard index -> list of (key, value) pairs
+        for (key, value) in items:
+            groups.setdefault(self._index(key), []).append((key, value))
+
+        with self._locked(groups): # each lock is acquired once per batch
+            for (idx, group) in groups.items():
+                self._shards[idx].update(group)
+
+
+    @classmethod
+    def from_items(cls, items, nshards=16):
+        """Creates instance from given (key, value) pairs, or mapping."""
+
+        shared = cls(nshards)
+        shared.update_many(items)
+        return shared
+
+
+    def set_many(self, items):
+        """Sets items from given (key, value) pairs, or mapping. Atomic."""
+
+        self.update_many(items)
+
+
+    def update(self, items):
+        """Sets items from given (key, value) pairs, or mapping. Atomic."""
+
+        self.update_many(items)
+
+
+    def get_many(self, keys, default=None):
+        """Returns the list of items which keys are given (default value for
+        missing keys). Atomic."""
+
+        groups = dict() # shard index -> list of (position, key) pairs
+        for (pos, key) in enumerate(keys):
+            groups.setdefault(self._index(key), []).append((pos, key))
+
+        values = [default] * sum(map(len, groups.values()))
+        with self._locked(groups):
+            for (idx, group) in groups.items():
+                get = self._shards[idx].get
+                for (pos, key) in group:
+                    values[pos] = get(key, default)
+        return values
+
+
+    def delete_many(self, keys):
+        """Deletes items which keys are given. Atomic: if a key is missing,
+        no item is deleted."""
+
+        groups = dict() # shard index -> list of keys
+        for key in dict.fromkeys(keys): # drops duplicates
+            groups.setdefault(self._index(key), []).append(key)
+
+        with self._locked(groups):
+            for (idx, group) in groups.items():
+                for key in group:
+                    if key not in self._shards[idx]:
+                        raise KeyError(key)
+            for (idx, group) in groups.items():
+                collections.deque(map(self._shards[idx].pop, group), maxlen=0)
+
+
+    def items(self):
+        """Returns a list of (key, value) pairs (weakly consistent)."""
+
+        pairs = []
+        for (shard, lock) in zip(self._shards, self._locks):
+            with lock:
+                pairs.extend(shard.items())
+        return pairs
+
+
+    def __iter__(self):
+        """Iterates over keys (weakly consistent)."""
+
+        for (shard, lock) in zip(self._shards, self._locks):
+            with lock:
+                keys = list(shard) # copy, so that the lock is not held
+            yield from keys        # while the caller processes keys
+
+
+
+# --------------------------------- ON DISK -----------------------------------
+
+
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+
+
+def _keyhash(key):
+    """Returns a 64-bit hash of given bytes, stable across processes."""
+    # Built-in function hash() cannot be used for data stored on disk, as it
+    # gives different results for the same str or bytes object each time the
+    # interpreter starts.
+
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(),
+                          "little")
+        # NB: All bits must be well mixed, as the slot of a key in _HashIndex
+        # is taken from the low bits. Checksums such as zlib.adler32() give
+        # almost the same low bits for similar keys ('key1', 'key2', etc.).
+
+
+
+def _syncdir(path):
+    """Forces entries of directory at given path (e.g. renamed files) to
+    disk. Only has an effect on POSIX systems."""
+
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+
+class _HashIndex:
+    """Hash table stored in a file and accessed through a memory map, which
+    maps keys to the offsets of their records in a log (internal use only)."""
+
+    # Collisions are handled with linear probing: if the slot for a key is
+    # taken, we try the next one, and so on. Deleted slots are marked as such
+    # (rather than emptied) so that probing does not stop at them.
+
+    MAGIC = b"WDICTIDX"
+    HEADER = struct.Struct("<8s?QQQQ")
+        # Magic, clean flag, number of slots, items, used slots, log size
+    SLOT = struct.Struct("<QQ") # key hash, record offset + 1
+    DELETED = 2**64 - 1 # offset field of deleted slots (0 for empty slots)
+
+
+    def __init__(self, path, nslots=None):
+        """Opens index file at given path. Creates it first (empty) if given
+        a number of slots."""
+
+        if nslots is not None:
+            with open(path, "wb") as file:
+                file.write(self.HEADER.pack(self.MAGIC, False, nslots,
+                                            0, 0, 0))
+                file.truncate(self.HEADER.size + nslots * self.SLOT.size)
+
+        self.path = path
+        self._open()
+        if (self.magic != self.MAGIC # check file
+                or len(self._map) != (self.HEADER.size
+                                      + self.nslots * self.SLOT.size)):
+            self.close(clean=False)
+            raise ValueError("invalid index file '{}'".format(path))
+
+
+    def _open(self):
+        """Maps index file and reads its header."""
+
+        self._file = open(self.path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        (self.magic, self.clean, self.nslots, self.count, self.used,
+                self.logsize) = self.HEADER.unpack_from(self._map)
+
+
+    def save(self):
+        """Writes header to the index file."""
+
+        self.HEADER.pack_into(self._map, 0, self.MAGIC, self.clean,
+                self.nslots, self.count, self.used, self.logsize)
+        self._map.flush()
+
+
+    def sync(self):
+        """Forces index file to disk."""
+
+        self._map.flush()
+        os.fsync(self._file.fileno())
+
+
+    def close(self, clean):
+        """Saves header with given clean flag, and closes index file."""
+
+        self.clean = clean
+        self.save()
+        self._map.close()
+        self._file.close()
+
+
+    def _probe(self, keyhash, matches):
+        """Returns index of the slot holding given key (-1 if none), and
+        index of the first slot where it could be inserted.
+        Function 'matches(offset)' tells whether the record at given offset
+        has the right key (None when keys are known to be unique)."""
+
+        (unpack, size) = (self.SLOT.unpack_from, self.SLOT.size)
+        base = self.HEADER.size
+        idx = keyhash % self.nslots
+        free = -1
+        while True:
+            (slothash, offset) = unpack(self._map, base + idx * size)
+            if offset == 0: # empty slot: key is not in the table
+                return (-1, idx if free < 0 else free)
+            if offset == self.DELETED:
+                if free < 0:
+                    free = idx
+            elif (slothash == keyhash and matches is not None
+                    and matches(offset - 1)):
+                return (idx, free)
+            idx = (idx + 1) % self.nslots
+
+
+    def get(self, keyhash, matches):
+        """Returns offset of the record of given key (-1 if none)."""
+
+        (idx, _) = self._probe(keyhash, matches)
+        if idx < 0:
+            return -1
+        return self.SLOT.unpack_from(self._map,
+                self.HEADER.size + idx * self.SLOT.size)[1] - 1
+
+
+    def put(self, keyhash, offset, matches):
+        """Sets offset of the record of given key."""
+
+        (idx, free) = self._probe(keyhash, matches)
+        if idx < 0: # new key
+            idx = free
+            position = self.HEADER.size + idx * self.SLOT.size
+            if self.SLOT.unpack_from(self._map, position)[1] == 0:
+                self.used += 1
+            self.count += 1
+        self.SLOT.pack_into(self._map, self.HEADER.size + idx * self.SLOT.size,
+                keyhash, offset + 1)
+        if self.used > 0.7 * self.nslots: # keep probe sequences short
+            self._grow()
+
+
+    def remove(self, keyhash, matches):
+        """Removes given key. Returns False if there was no such key."""
+
+        (idx, _) = self._probe(keyhash, matches)
+        if idx < 0:
+            return False
+        self.SLOT.pack_into(self._map, self.HEADER.size + idx * self.SLOT.size,
+                0, self.DELETED)
+        self.count -= 1
+        return True
+
+
+    # Methods below process a whole batch of keys in a single loop, with the
+    # probe sequence written inline: they save several method calls per key
+    # compared to get(), put() and remove().
+
+
+    def get_many(self, entries, keyat):
+        """Returns the list of offsets of the records of given keys (-1 for
+        missing keys), given (key hash, key) pairs. Function 'keyat(offset)'
+        returns the key of the record at given offset."""
+
+        (unpack, size) = (self.SLOT.unpack_from, self.SLOT.size)
+        (base, nslots, table) = (self.HEADER.size, self.nslots, self._map)
+        offsets = []
+        for (keyhash, key) in entries:
+            idx = keyhash % nslots
+            while True:
+                (slothash, offset) = unpack(table, base + idx * size)
+                if offset == 0: # empty slot: key is not in the table
+                    offsets.append(-1)
+                    break
+                if (slothash == keyhash and offset != self.DELETED
+                        and keyat(offset - 1) == key):
+                    offsets.append(offset - 1)
+                    break
+                idx = (idx + 1) % nslots
+        return offsets
+
+
+    def update(self, changes, keyat):
+        """Applies given (key hash, key, offset) changes: sets the offset of
+        the record of each key, or removes the key if offset is None.
+        Function 'keyat(offset)' returns the key of the record at given
+        offset (None when keys are known to be unique and new)."""
+
+        changes = list(changes)
+        if self.used + len(changes) > 0.7 * self.nslots: # worst case
+            self._grow(len(changes)) # once for the whole batch
+        (unpack, pack) = (self.SLOT.unpack_from, self.SLOT.pack_into)
+        (base, size) = (self.HEADER.size, self.SLOT.size)
+        (nslots, table, deleted) = (self.nslots, self._map, self.DELETED)
+        for (keyhash, key, newoffset) in changes:
+            idx = keyhash % nslots
+            (found, free) = (-1, -1)
+            while True:
+                (slothash, offset) = unpack(table, base + idx * size)
+                if offset == 0: # empty slot: key is not in the table
+                    break
+                if offset == deleted:
+                    if free < 0:
+                        free = idx
+                elif (slothash == keyhash and keyat is not None
+                        and keyat(offset - 1) == key):
+                    found = idx
+                    break
+                idx = (idx + 1) % nslots
+            if newoffset is None: # deletion
+                if found >= 0:
+                    pack(table, base + found * size, 0, deleted)
+                    self.count -= 1
+                continue
+            if found < 0: # new key
+                if free < 0: # uses the empty slot
+                    (free, self.used) = (idx, self.used + 1)
+                (found, self.count) = (free, self.count + 1)
+            pack(table, base + found * size, keyhash, newoffset + 1)
+
+
+    def slots(self):
+        """Iterates over (key hash, record offset) pairs of all keys."""
+
+        for idx in range(self.nslots):
+            (keyhash, offset) = self.SLOT.unpack_from(self._map,
+                    self.HEADER.size + idx * self.SLOT.size)
+            if offset != 0 and offset != self.DELETED:
+                yield (keyhash, offset - 1)
+
+
+    def _grow(self, extra=0):
+        """Rebuilds the table without its deleted slots, with room for given
+        number of extra keys. Doubles the number of slots as many times as
+        live keys need it, else keeps it (when most used slots were deleted
+        ones)."""
+
+        nslots = self.nslots
+        while self.count + extra >= 0.35 * nslots:
+            nslots *= 2
+        bigger = _HashIndex(self.path + ".tmp", nslots)
+        bigger.update(((keyhash, None, offset) for (keyhash, offset)
+                       in self.slots()), None) # keys are unique here
+        bigger.logsize = self.logsize
+        bigger.close(clean=False)
+        self._map.close()
+        self._file.close()
+        os.replace(bigger.path, self.path) # atomic
+        self._open()
+
+
+
+class DiskWDict:
+    """Dictionary wrapper class storing items in a directory on disk, for
+    data which does not fit in memory. Keys and values are bytes (str keys
+    and values are encoded in UTF-8)."""
+
+    # About the storage
+    # -----------------
+    # Items are written one after the other at the end of a log file (they
+    # are never overwritten), as records made of a header (checksum, key
+    # length, value length), the key and the value. Deleting an item writes a
+    # "deletion record". An index file (see _HashIndex) maps each key to its
+    # last record. Both files are accessed through memory maps, so the
+    # operating system loads from disk only the pages we actually read, and
+    # values can be returned as memoryviews on the map, without any copy.
+
+    # About writes
+    # ------------
+    # Items are kept in memory until 'batch' of them are waiting, then written
+    # to the log in a single write (see flush()).
+
+    # About crashes
+    # -------------
+    # The log is the reference: the index is just a way to find records fast.
+    # While a DiskWDict is open, its index file is flagged as not clean, and
+    # the flag is only set back by close(). When opening a DiskWDict whose
+    # index is not clean (e.g. after a crash), the index is rebuilt by reading
+    # the whole log, which ends at the last record with a valid checksum.
+
+    # About compaction
+    # ----------------
+    # Overwritten and deleted items still use space in the log. Method
+    # compact() copies live records to a new log while other threads keep
+    # using the DiskWDict, then catches up with records written in the
+    # meantime and replaces the files.
+    # NB: Replacing files which are still open only works on POSIX systems.
+
+    RECORD = struct.Struct("<III") # checksum, key length, value length
+    DELETED = 2**32 - 1 # value length of deletion records
+
+
+    def __init__(self, path, batch=1000, sync=False):
+        """Opens DiskWDict stored in directory at given path (creates it if
+        needed). Option 'sync' forces data to disk after each batch."""
+
+        os.makedirs(path, exist_ok=True)
+        self._logpath = os.path.join(path, "values.log")
+        self._indexpath = os.path.join(path, "index.bin")
+        self._batch = batch
+        self._sync = sync
+        self._pending = dict() # key -> value (None for deletions)
+        self._lock = threading.RLock() # reentrant: methods call each other
+        self._compactor = None # compaction thread
+
+        self._logfile = open(self._logpath, "ab") # appends at end of file
+        self._readfile = open(self._logpath, "rb")
+        self._logsize = self._logfile.tell()
+        self._logmap = None
+        self._remap()
+
+        try:
+            self._index = _HashIndex(self._indexpath)
+        except (OSError, ValueError, struct.error): # missing or invalid
+            self._index = None
+        if (self._index is None or not self._index.clean
+                or self._index.logsize != self._logsize):
+            if self._index is not None:
+                self._index.close(clean=False)
+            self._rebuild()
+        self._index.clean = False # until close() is called
+        self._index.save()
+
+
+    @staticmethod
+    def _tobytes(obj):
+        """Returns given key or value as bytes."""
+
+        if isinstance(obj, str):
+            return obj.encode("utf-8")
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            return bytes(obj)
+        raise TypeError("keys and values must be bytes or str objects")
+
+
+    def _remap(self):
+        """Maps the log file again (after it has grown)."""
+
+        self._logmap = None
+        if self._logsize > 0: # cannot map an empty file
+            self._logmap = mmap.mmap(self._readfile.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        # NB: We do not close the previous map, as memoryviews returned by
+        # __getitem__ may still use it. It is closed once they are deleted.
+
+
+    def _record(self, key, value):
+        """Returns record for given key and value (None for deletion)."""
+
+        vlen = self.DELETED if value is None else len(value)
+        body = struct.pack("<II", len(key), vlen) + key + (value or b"")
+        return struct.pack("<I", zlib.crc32(body)) + body
+
+
+    def _scan(self, logmap, start, end):
+        """Iterates over (offset, next offset, key, deleted) tuples for
+        records of given log map between given offsets. Stops at the first
+        incomplete or corrupted record."""
+
+        offset = start
+        while offset + self.RECORD.size <= end:
+            (checksum, klen, vlen) = self.RECORD.unpack_from(logmap, offset)
+            deleted = (vlen == self.DELETED)
+            stop = offset + self.RECORD.size + klen + (0 if deleted else vlen)
+            if stop > end or zlib.crc32(logmap[offset+4:stop]) != checksum:
+                return
+            keystart = offset + self.RECORD.size
+            yield (offset, stop, logmap[keystart:keystart+klen], deleted)
+            offset = stop
+
+
+    def _keyat(self, logmap, offset):
+        """Returns key of the record at given offset of given log map."""
+
+        klen = self.RECORD.unpack_from(logmap, offset)[1]
+        start = offset + self.RECORD.size
+        return logmap[start:start+klen]
+
+
+    def _apply(self, index, logmap, offset, key, deleted):
+        """Updates given index with record at given offset of given log."""
+
+        matches = lambda recoffset: self._keyat(logmap, recoffset) == key
+        if deleted:
+            index.remove(_keyhash(key), matches)
+        else:
+            index.put(_keyhash(key), offset, matches)
+
+
+    def _rebuild(self):
+        """Rebuilds the index from the log, dropping any incomplete record
+        at the end of the log."""
+
+        self._index = _HashIndex(self._indexpath, nslots=1024)
+        end = 0
+        if self._logmap is not None:
+            for (offset, end, key, deleted) in self._scan(self._logmap, 0,
+                                                          self._logsize):
+                self._apply(self._index, self._logmap, offset, key, deleted)
+        if end < self._logsize: # incomplete record (e.g. crash during write)
+            self._logfile.truncate(end)
+            self._logsize = end
+            self._remap()
+        self._index.logsize = self._logsize
+
+
+    def _find(self, key):
+        """Returns offset of the last record of given key in the log (-1 if
+        it is not in the log)."""
+
+        return self._index.get(_keyhash(key),
+                lambda offset: self._keyat(self._logmap, offset) == key)
+
+
+    def _exists(self, key):
+        """Returns True if given key exists, else False."""
+
+        if key in self._pending:
+            return self._pending[key] is not None
+        return self._find(key) >= 0
+
+
+    def __repr__(self): # Representation
+        """Returns a short string representation of the DiskWDict."""
+
+        return "DiskWDict: {} items in '{}'".format(len(self),
+                os.path.dirname(self._logpath))
+
+
+    def __getitem__(self, key): # Item getter
+        """Returns item which key is given, as a read-only memoryview on the
+        log if the item is on disk (as bytes if not)."""
+
+        key = self._tobytes(key)
+        with self._lock:
+            if key in self._pending:
+                value = self._pending[key]
+                if value is None:
+                    raise KeyError(key)
+                return value
+            offset = self._find(key)
+            if offset < 0:
+                raise KeyError(key)
+            (_, klen, vlen) = self.RECORD.unpack_from(self._logmap, offset)
+            start = offset + self.RECORD.size + klen
+            return memoryview(self._logmap)[start:start+vlen] # no copy
+
+
+    def get(self, key, default=None):
+        """Returns item which key is given, or default value if there is
+        no such item."""
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def __setitem__(self, key, value): # Item setter
+        """Sets item which key is given to given value."""
+
+        (key, value) = (self._tobytes(key), self._tobytes(value))
+        with self._lock:
+            self._pending[key] = value
+            if len(self._pending) >= self._batch:
+                self.flush()
+
+
+    def __delitem__(self, key): # Item deleter
+        """Deletes item which key is given."""
+
+        key = self._tobytes(key)
+        with self._lock:
+            if not self._exists(key):
+                raise KeyError(key)
+            self._pending[key] = None
+            if len(self._pending) >= self._batch:
+                self.flush()
+
+
+    def __contains__(self, key): # Item finder
+        """Returns True if given key exists, else False."""
+
+        with self._lock:
+            return self._exists(self._tobytes(key))
+
+
+    @classmethod
+    def from_items(cls, path, items, **options):
+        """Opens DiskWDict stored in directory at given path, and sets items
+        from given (key, value) pairs, or mapping. Other arguments are passed
+        to the initializer."""
+
+        store = cls(path, **options)
+        store.set_many(items)
+        return store
+
+
+    def set_many(self, items):
+        """Sets items from given (key, value) pairs, or mapping. A batch
+        bigger than 'batch' items is written in a single write."""
+
+        if hasattr(items, "items"): # mapping
+            items = items.items()
+        tobytes = self._tobytes
+        items = [(tobytes(key), tobytes(value)) for (key, value) in items]
+        with self._lock:
+            self._pending.update(items)
+            if len(self._pending) >= self._batch:
+                self.flush()
+
+
+    def update(self, items):
+        """Sets items from given (key, value) pairs, or mapping."""
+
+        self.set_many(items)
+
+
+    def get_many(self, keys, default=None):
+        """Returns the list of items which keys are given (default value for
+        missing keys)."""
+
+        keys = [self._tobytes(key) for key in keys]
+        with self._lock: # acquired once for the whole batch
+            self.flush() # so that all keys are looked up in the index
+            offsets = self._index.get_many(
+                    zip(map(_keyhash, keys), keys),
+                    functools.partial(self._keyat, self._logmap))
+            (logview, unpack) = (memoryview(self._logmap or b""),
+                                 self.RECORD.unpack_from)
+            values = []
+            for offset in offsets:
+                if offset < 0:
+                    values.append(default)
+                    continue
+                (_, klen, vlen) = unpack(self._logmap, offset)
+                start = offset + self.RECORD.size + klen
+                values.append(logview[start:start+vlen]) # no copy
+            return values
+
+
+    def delete_many(self, keys):
+        """Deletes items which keys are given. If a key is missing, no item
+        is deleted."""
+
+        keys = [self._tobytes(key) for key in keys]
+        with self._lock:
+            for key in keys:
+                if not self._exists(key):
+                    raise KeyError(key)
+            self._pending.update(zip(keys, itertools.repeat(None)))
+            if len(self._pending) >= self._batch:
+                self.flush()
+
+
+    def __len__(self): # Length
+        """Returns the number of items."""
+
+        with self._lock:
+            self.flush()
+            return self._index.count
+
+
+    def __iter__(self):
+        """Iterates over keys (as bytes), as they were when called."""
+
+        with self._lock:
+            self.flush()
+            keys = [self._keyat(self._logmap, offset)
+                    for (_, offset) in self._index.slots()]
+        return iter(keys)
+
+
+    def flush(self):
+        """Writes pending items to the log in a single write."""
+
+        with self._lock:
+            if not self._pending:
+                return
+            records = []
+            offsets = []
+            offset = self._logsize
+            for (key, value) in self._pending.items():
+                record = self._record(key, value)
+                records.append(record)
+                offsets.append(offset)
+                offset += len(record)
+            self._logfile.write(b"".join(records))
+            self._logfile.flush()
+            if self._sync:
+                os.fsync(self._logfile.fileno())
+            self._logsize = offset
+            self._remap()
+            self._index.update(
+                    ((_keyhash(key), key, None if value is None else offset)
+                     for ((key, value), offset)
+                     in zip(self._pending.items(), offsets)),
+                    functools.partial(self._keyat, self._logmap))
+            self._pending.clear()
+
+
+    def compact(self, background=True):
+        """Rewrites the log without overwritten or deleted items. If
+        'background' is True, runs in a new thread, which is returned."""
+
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return self._compactor # already running
+            if not background:
+                self._compact()
+                return None
+            self._compactor = threading.Thread(target=self._compact)
+            self._compactor.start()
+            return self._compactor
+
+
+    def _compact(self):
+        """Rewrites the log without overwritten or deleted items."""
+
+        # Step 1: copy records which are live, up to the current end of log
+        with self._lock:
+            self.flush()
+            (oldmap, end) = (self._logmap, self._logsize)
+            newindex = _HashIndex(self._indexpath + ".compact",
+                                  self._index.nslots)
+        newlog = open(self._logpath + ".compact", "w+b")
+        newsize = 0
+        if oldmap is not None:
+            records = self._scan(oldmap, 0, end)
+            while True:
+                chunk = list(itertools.islice(records, 1000))
+                if not chunk:
+                    break
+                with self._lock: # a record is live if the index points to it
+                    chunk = [record for record in chunk if not record[3]
+                             and self._find(record[2]) == record[0]]
+                for (offset, stop, key, _) in chunk: # without lock
+                    newlog.write(oldmap[offset:stop])
+                    newindex.put(_keyhash(key), newsize, None) # unique keys
+                    newsize += stop - offset
+
+        # Step 2: catch up with records written during step 1, and switch
+        with self._lock:
+            self.flush()
+            tail = []
+            if self._logsize > end:
+                tail = list(self._scan(self._logmap, end, self._logsize))
+                newlog.write(self._logmap[end:self._logsize])
+            newlog.flush()
+            newmap = None
+            if tail:
+                newmap = mmap.mmap(newlog.fileno(), 0, access=mmap.ACCESS_READ)
+                for (offset, _, key, deleted) in tail:
+                    self._apply(newindex, newmap, newsize + offset - end,
+                                key, deleted)
+            newsize += self._logsize - end
+            newindex.logsize = newsize
+            newindex.save()
+            newindex.sync()
+            if newmap is not None:
+                newmap.close()
+            os.fsync(newlog.fileno()) # new files must be on disk BEFORE
+            newlog.close()            # they replace the old ones
+
+            self._index.close(clean=False)
+            self._logfile.close()
+            self._readfile.close()
+            os.replace(newlog.name, self._logpath)
+            os.replace(newindex.path, self._indexpath)
+            _syncdir(os.path.dirname(self._logpath)) # saves the renaming
+            newindex.path = self._indexpath
+            self._index = newindex
+            self._logfile = open(self._logpath, "ab")
+            self._readfile = open(self._logpath, "rb")
+            self._logsize = newsize
+            self._remap()
+
+
+    def close(self):
+        """Writes pending items and closes the DiskWDict."""
+
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            self.flush()
+            self._index.logsize = self._logsize
+            self._index.close(clean=True)
+            self._logfile.close()
+            self._readfile.close()
+            self._logmap = None
+
+
+    def __enter__(self):
+        """Enters context (see 'with' statement)."""
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exits context: closes the DiskWDict."""
+
+        self.close()
 
 
 
@@ -101,10 +1611,12 @@ import misctest as mt
 mt.sectprint("Create instance")
 mydict = WDict()
 mt.instprint(mydict)
+mt.sectprint("Attach tracer")
+mydict.set_tracer(print_tracer)
+print("Class of instance:", mt.classname(mydict))
 mt.sectprint("Set item")
 mydict["devil"] = 666
 mydict["truth"] = 42
-mt.instprint(mydict)
 mt.sectprint("Print instance")
 print(mydict)
 mt.sectprint("Get length")
@@ -118,6 +1630,271 @@ mt.sectprint("Delete item")
 del mydict[key]
 print("Key '{}' exists: {}".format(key, (key in mydict)))
 print(mydict)
-mt.sectprint("Delete instance")
-content = mydict._dictattr
-del mydict
\ No newline at end of file
+mt.sectprint("Count operations")
+counter = OpCounter(every=2)
+mydict.set_tracer(counter)
+for idx in range(10):
+    mydict[idx] = idx**2
+    mydict[idx] += 1
+print(counter)
+print("Sampled operations:", list(counter.samples))
+mt.sectprint("Pickle instance")
+import pickle
+copied = pickle.loads(pickle.dumps(mydict)) # the tracer is not pickled
+print("Class of copy:", mt.classname(copied), "| Copy:", copied)
+assert copied == mydict and copied._tracer is None
+mt.sectprint("Detach tracer")
+mydict.set_tracer(None)
+print("Class of instance:", mt.classname(mydict))
+
+
+mt.sectprint("Benchmark")
+
+import timeit
+
+NUMBER = 5*10**5
+KEYS = ["key{}".format(idx) for idx in range(1000)]
+
+def benchmark(container):
+    """Returns duration (in seconds) of NUMBER set, get and find operations."""
+
+    def operations():
+        for key in KEYS:
+            container[key] = key
+            container[key]
+            key in container
+
+    return timeit.timeit(operations, number=NUMBER//len(KEYS))
+
+reference = benchmark(dict())
+print("dict: {:.3f} s".format(reference))
+duration = benchmark(WDict())
+print("WDict: {:.3f} s ({:+.1%} vs dict)".format(
+        duration, duration/reference - 1))
+traced = WDict()
+traced.set_tracer(OpCounter())
+duration = benchmark(traced)
+print("WDict with OpCounter: {:.3f} s ({:+.1%} vs dict)".format(
+        duration, duration/reference - 1))
+
+# NB: Even without tracer, 'instance[key]' remains a bit slower on a WDict than
+# on a 'dict' (CPython 3.11+ has a specialized fast path for exact 'dict'
+# instances only), while methods (get(), etc.) run at the same speed.
+
+
+mt.sectprint("Cache (LRU policy)")
+cache = CacheWDict(maxitems=3)
+for key in ("a", "b", "c"):
+    cache[key] = key.upper()
+cache["a"] # 'a' becomes the most recently used item
+cache["d"] = "D" # evicts 'b', the least recently used item
+print(cache)
+print("Key 'b' exists:", "b" in cache)
+print(cache.stats())
+
+mt.sectprint("Cache (LFU policy)")
+cache = CacheWDict(maxitems=3, policy="lfu")
+for key in ("a", "b", "c"):
+    cache[key] = key.upper()
+for key in ("a", "a", "b", "c", "c"):
+    cache[key]
+cache["d"] = "D" # evicts 'b', the least frequently used item
+print(cache)
+print(cache.stats())
+
+mt.sectprint("Cache (size limit)")
+cache = CacheWDict(maxbytes=1000)
+cache["small"] = "tiny"
+cache["medium"] = "x" * 300
+cache["big"] = "x" * 600 # evicts 'small', the least recently used item
+print("Keys:", list(cache))
+print(cache.stats())
+
+mt.sectprint("Cache (time-to-live)")
+now = [0] # fake clock, so that we do not have to wait
+cache = CacheWDict(ttl=60, clock=lambda: now[0])
+cache["short"] = "expires soon"
+cache.set("long", "expires later", ttl=3600)
+now[0] = 120 # two minutes later...
+print("Get 'short':", cache.get("short"))
+print("Get 'long':", cache.get("long"))
+print(cache.stats())
+
+
+mt.sectprint("Sharded dictionary")
+shared = ShardedWDict(nshards=4)
+shared.update_many([("devil", 666), ("truth", 42)])
+print("get_or_set('answer'):", shared.get_or_set("answer", lambda: 7*6))
+print("setdefault('truth'):", shared.setdefault("truth", 0))
+print(shared)
+print("Keys:", list(shared))
+
+
+mt.sectprint("Benchmark (threads)")
+
+
+class LockedWDict(WDict):
+    """WDict protected by a single lock (for comparison)."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            dict.__setitem__(self, key, value)
+
+
+def contention(container, nthreads, nops=64000):
+    """Returns number of operations per second when 'nthreads' threads
+    share given container (for a total of 'nops' operations)."""
+
+    def work(offset):
+        for idx in range(nops // nthreads):
+            key = (offset + idx) % 1000
+            container[key] = idx
+            container[key]
+
+    threads = [threading.Thread(target=work, args=(num,))
+               for num in range(nthreads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return 2 * nops / (time.perf_counter() - start)
+
+
+print("THREADS\tONE LOCK (op/s)\tSHARDED (op/s)")
+for nthreads in (1, 2, 4, 8, 16, 32, 64):
+    print("{}\t{:.0f}\t\t{:.0f}".format(nthreads,
+            contention(LockedWDict(), nthreads),
+            contention(ShardedWDict(), nthreads)))
+
+# NB: In CPython, only one thread runs Python code at a time (because of the
+# Global Interpreter Lock), so throughput does not grow with the number of
+# threads. Sharding reduces the time threads spend waiting for each other's
+# locks, and pays off as soon as operations release the GIL (e.g. I/O) or on
+# free-threaded builds of Python.
+
+
+mt.sectprint("Dictionary on disk")
+
+import tempfile
+
+folder = tempfile.mkdtemp() # temporary directory
+with DiskWDict(folder, batch=100) as store:
+    for idx in range(1000):
+        store["key{}".format(idx)] = "value{}".format(idx)
+    store["devil"] = b"666"
+    del store["key0"]
+    print(store)
+    value = store["key42"]
+    print("Item 'key42' = {} (type: {})".format(bytes(value),
+            mt.classname(value)))
+    del value # releases the memoryview
+
+print("Reopening:", DiskWDict(folder)) # not closed: simulates a crash
+with open(os.path.join(folder, "values.log"), "ab") as log:
+    log.write(b"\x00\x01\x02") # simulates an incomplete write
+with DiskWDict(folder) as store:
+    print("Reopening after crash:", store)
+    print("Item 'devil' =", bytes(store["devil"]))
+    for idx in range(1, 1000):
+        store["key{}".format(idx)] = "new value{}".format(idx)
+    store.flush()
+    logsize = os.path.getsize(os.path.join(folder, "values.log"))
+    print("Log size before compaction: {} bytes".format(logsize))
+    thread = store.compact() # runs in the background...
+    store["during"] = "compaction" # ... while we keep using the store
+    thread.join()
+    store.flush()
+    logsize = os.path.getsize(os.path.join(folder, "values.log"))
+    print("Log size after compaction: {} bytes".format(logsize))
+    print("Item 'key999' = {}, item 'during' = {}".format(
+            bytes(store["key999"]), bytes(store["during"])))
+with DiskWDict(folder) as store:
+    print("Reopening after compaction:", store)
+    nslots = store._index.nslots
+    for step in range(100): # 100 distinct keys per step, set then deleted
+        keys = ["temp{}".format(step * 100 + idx) for idx in range(100)]
+        store.set_many(zip(keys, itertools.repeat("value")))
+        store.flush()
+        store.delete_many(keys)
+        store.flush()
+    print("Index slots after 10000 sets and deletes: {} (before: {})".format(
+            store._index.nslots, nslots))
+    assert store._index.nslots <= 2 * nslots # deleted slots are reused
+
+import shutil
+shutil.rmtree(folder)
+
+
+mt.sectprint("Bulk operations")
+
+mydict = WDict.from_items([("devil", 666), ("truth", 42)])
+mydict.set_many({"answer": 42, "beast": 666})
+print(mydict)
+print("get_many:", mydict.get_many(["truth", "beast", "nothing"]))
+mydict.delete_many(["devil", "beast"])
+print(mydict)
+
+
+mt.sectprint("Benchmark (bulk operations)")
+
+
+def timed(function, *args):
+    """Returns duration (in seconds) of call 'function(*args)'."""
+
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def set_one_by_one(container, items):
+    for (key, value) in items:
+        container[key] = value
+
+
+def get_one_by_one(container, keys):
+    return [container[key] for key in keys]
+
+
+def set_bulk(container, items):
+    container.set_many(items)
+
+
+def get_bulk(container, keys):
+    return container.get_many(keys)
+
+
+def make_disk_wdict():
+    """Returns a new DiskWDict in a new temporary directory."""
+
+    return DiskWDict(tempfile.mkdtemp())
+
+
+SIZE = 10**6
+keys = ["key{}".format(idx) for idx in range(SIZE)]
+items = list(zip(keys, keys))
+print("CONTAINER\tITEMS\tOPERATION\tONE BY ONE (s)\tBULK (s)")
+for (name, factory) in (("WDict", WDict), ("ShardedWDict", ShardedWDict),
+                        ("CacheWDict", CacheWDict),
+                        ("DiskWDict", make_disk_wdict)):
+    durations = []
+    for (setter, getter) in ((set_one_by_one, get_one_by_one),
+                             (set_bulk, get_bulk)):
+        container = factory() # new (empty) container for each run
+        durations.append((timed(setter, container, items),
+                          timed(getter, container, keys)))
+        if isinstance(container, DiskWDict):
+            container.close()
+            shutil.rmtree(os.path.dirname(container._logpath))
+    print("{}\t{}\tset\t\t{:.3f}\t\t{:.3f}".format(name, SIZE,
+            durations[0][0], durations[1][0]))
+    print("{}\t{}\tget\t\t{:.3f}\t\t{:.3f}".format(name, SIZE,
+            durations[0][1], durations[1][1]))
@@ -32,6 +32,9 @@ class Time:
         self._hours = hours
         self._mins = mins
         self._secs = secs
+        self._key = hours*3600 + mins*60 + secs # total number of seconds
+            # Precomputed once, so that comparisons and hashing only have to
+            # compare two integers (see sort_key() below).
 
 
 
@@ -183,16 +186,68 @@ class Time:
 
 
 
+    def sort_key(self):
+        """Returns the sorting key of calling Time instance (in seconds)."""
+        # Use as 'sorted(times, key=Time.sort_key)': the key is computed once
+        # per element, then sorting only compares integers (in C).
+
+        return self._key
+
+
+
+    def __hash__(self):
+        """Returns hash of calling Time instance."""
+        # Must be consistent with __eq__: equal Time objects must have equal
+        # hashes, so we hash the same key as the one used for comparisons.
+        # This makes Time objects usable as dict keys and set members.
+
+        return hash(self._key)
+
+
+
     def __eq__(self, time):
         """Asserts whether calling Time instance is equal to
         given Time instance."""
 
-        if not isinstance(time, type(self)): # check input
+        if not isinstance(time, Time): # check input
+            return NotImplemented # lets Python try 'time.__eq__(self)'
+                # Raising an error here would break dict or set lookups
+                # mixing Time objects with other objects.
+
+        return self._key == time._key
+
+
+
+    def __ne__(self, time):
+        """Asserts whether calling Time instance is different from
+        given Time instance."""
+
+        if not isinstance(time, Time): # check input
+            return NotImplemented
+
+        return self._key != time._key
+
+
+
+    def __lt__(self, time):
+        """Asserts whether calling Time instance is strictly lower than
+        given Time instance."""
+
+        if not isinstance(time, Time): # check input
+            raise TypeError("both operands must be Time objects")
+
+        return self._key < time._key
+
+
+
+    def __le__(self, time):
+        """Asserts whether calling Time instance is lower or equal to
+        given Time instance."""
+
+        if not isinstance(time, Time): # check input
             raise TypeError("both operands must be Time objects")
 
-        return (self._hours == time._hours      # This expression is evaluated
-                and self._mins == time._mins    # as boolean (class 'bool').
-                and self._secs == time._secs)   # Value is 'True' or 'False'.
+        return self._key <= time._key
 
 
 
@@ -200,12 +255,10 @@ class Time:
         """Asserts whether calling Time instance is strictly greater than
         given Time instance."""
 
-        if not isinstance(time, type(self)): # check input
+        if not isinstance(time, Time): # check input
             raise TypeError("both operands must be Time objects")
 
-        return (self._hours > time._hours
-                or (self._hours == time._hours and self._mins > time._mins)
-                or (self._mins == time._mins and self._secs > time._secs))
+        return self._key > time._key
 
 
 
@@ -213,20 +266,282 @@ class Time:
         """Asserts whether calling Time instance is greater or equal to
         given Time instance."""
 
-        if not isinstance(time, type(self)): # check input
+        if not isinstance(time, Time): # check input
             raise TypeError("both operands must be Time objects")
 
-        return (self > time or self == time)
-    
+        return self._key >= time._key
+
 
     # About comparison
     # ----------------
     # Python can infer __ne__, __lt__ and __le__ methods from previously
-	# defined __eq__, __gt__ and __ge__ methods (or the other way around),
-    #  so we do not need to define them here.
-	
-	
-	
+    # defined __eq__, __gt__ and __ge__ methods (or the other way around),
+    # but only by calling the reflected method on the other operand, which
+    # doubles the cost of each comparison (e.g. in sorted()). So we define
+    # all six of them here, each one comparing the precomputed keys.
+    # NB: Comparing keys also makes '1:60:00' and '2:00:00' equal, and handles
+    # negative times, whatever the sign of each field.
+
+    # About hashing
+    # -------------
+    # A class which defines __eq__ but not __hash__ gets '__hash__ = None',
+    # which means its instances are unhashable.
+
+
+
+import random
+
+
+class _IntervalNode:
+    """Node of a TimeIntervalIndex (internal use only)."""
+
+    __slots__ = ("start", "end", "key", "maxend", "priority", "left", "right")
+
+
+    def __init__(self, start, end):
+        """Creates _IntervalNode instance."""
+
+        self.start = start
+        self.end = end
+        self.key = (start._key, end._key) # nodes are sorted by (start, end)
+        self.maxend = end._key # greatest end key in the subtree of this node
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+
+
+
+class TimeIntervalIndex:
+    """Index of closed Time intervals [start, end], answering overlap
+    and stabbing queries without scanning every interval."""
+
+    # About the implementation
+    # ------------------------
+    # This is an interval tree: a binary search tree sorted by interval
+    # starts, where each node also stores the greatest end of its subtree
+    # ('maxend'). A query can then skip any subtree which ends before the
+    # queried interval, and stop as soon as starts go past it. It still
+    # visits nodes which do not match, when their subtree holds a match, so a
+    # query costs O(min(n, k log n)), where k is the number of intervals
+    # found (far less than scanning all n intervals when k is small).
+    # The tree is kept balanced as a "treap": each node gets a random
+    # priority, and parents always have a higher priority than their
+    # children, which gives a depth of O(log n) on average.
+    # Keys are the ones Time uses for its own comparison operators, so the
+    # index orders intervals exactly as the operators would.
+
+
+    def __init__(self, intervals=()):
+        """Creates TimeIntervalIndex instance from given (start, end)
+        pairs, in any order."""
+
+        self._root = None
+        self._len = 0
+        nodes = sorted((self._makenode(*pair) for pair in intervals),
+                key=lambda node: node.key)
+        self._bulkload(nodes)
+
+
+
+    @classmethod
+    def from_sorted(cls, intervals):
+        """Creates TimeIntervalIndex instance from given (start, end) pairs,
+        which must be sorted by start, then by end. Runs in O(n)."""
+
+        index = cls()
+        nodes = [cls._makenode(*pair) for pair in intervals]
+        for idx in range(1, len(nodes)): # check input
+            if nodes[idx].key < nodes[idx-1].key:
+                raise ValueError("intervals must be sorted")
+        index._bulkload(nodes)
+        return index
+
+
+
+    @staticmethod
+    def _makenode(start, end):
+        """Checks given interval and returns a new node for it."""
+
+        if not (isinstance(start, Time) and isinstance(end, Time)):
+            raise TypeError("interval bounds must be Time objects")
+        if end < start:
+            raise ValueError("interval end must not be lower than its start")
+
+        return _IntervalNode(start, end)
+
+
+
+    def _bulkload(self, nodes):
+        """Builds the tree from given nodes, sorted by key."""
+
+        # Build the treap in one pass: a stack holds the rightmost branch of
+        # the tree built so far (a.k.a. Cartesian tree construction).
+        stack = []
+        for node in nodes:
+            last = None
+            while stack and stack[-1].priority < node.priority:
+                last = stack.pop()
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+
+        # Compute 'maxend' fields, children first
+        order = []
+        pending = stack[:1]
+        while pending:
+            node = pending.pop()
+            order.append(node)
+            pending.extend(child for child in (node.left, node.right) if child)
+        for node in reversed(order):
+            self._update(node)
+
+        self._root = stack[0] if stack else None
+        self._len = len(nodes)
+
+
+
+    @staticmethod
+    def _update(node):
+        """Recomputes 'maxend' field of given node from its children."""
+
+        maxend = node.end._key
+        if node.left is not None and node.left.maxend > maxend:
+            maxend = node.left.maxend
+        if node.right is not None and node.right.maxend > maxend:
+            maxend = node.right.maxend
+        node.maxend = maxend
+
+
+
+    def _split(self, node, key):
+        """Splits subtree of given node into two subtrees, holding keys
+        strictly lower than given key, and the others."""
+
+        if node is None:
+            return (None, None)
+        if node.key < key:
+            (node.right, right) = self._split(node.right, key)
+            self._update(node)
+            return (node, right)
+        else:
+            (left, node.left) = self._split(node.left, key)
+            self._update(node)
+            return (left, node)
+
+
+
+    def _merge(self, left, right):
+        """Merges two subtrees, all keys of the left one being lower than
+        the keys of the right one."""
+
+        if left is None:
+            return right
+        if right is None:
+            return left
+        if left.priority > right.priority:
+            left.right = self._merge(left.right, right)
+            self._update(left)
+            return left
+        else:
+            right.left = self._merge(left, right.left)
+            self._update(right)
+            return right
+
+
+
+    def insert(self, start, end):
+        """Adds interval [start, end] to the index. Runs in O(log n)."""
+
+        node = self._makenode(start, end)
+        (left, right) = self._split(self._root, node.key)
+        self._root = self._merge(self._merge(left, node), right)
+        self._len += 1
+
+
+
+    def remove(self, start, end):
+        """Removes interval [start, end] from the index (only once if it was
+        inserted several times). Runs in O(log n)."""
+
+        key = self._makenode(start, end).key
+        (left, right) = self._split(self._root, key)
+        (middle, right) = self._split(right, (key[0], key[1] + 1))
+            # 'middle' holds all intervals equal to [start, end]
+        if middle is None:
+            self._root = self._merge(left, right)
+            raise KeyError((start, end))
+        middle = self._merge(middle.left, middle.right) # drops one interval
+        self._root = self._merge(self._merge(left, middle), right)
+        self._len -= 1
+
+
+
+    def overlap(self, start, end):
+        """Returns the list of intervals overlapping [start, end], sorted
+        by start, then by end."""
+
+        if not (isinstance(start, Time) and isinstance(end, Time)):
+            raise TypeError("interval bounds must be Time objects")
+        (low, high) = (start._key, end._key)
+
+        # In-order traversal, skipping subtrees which end before 'low'
+        found = []
+        stack = []
+        node = self._root
+        while True:
+            while node is not None and node.maxend >= low:
+                stack.append(node)
+                node = node.left
+            if not stack:
+                break
+            node = stack.pop()
+            if node.key[0] > high: # next intervals start even later
+                break
+            if node.end._key >= low:
+                found.append((node.start, node.end))
+            node = node.right
+
+        return found
+
+
+
+    def stab(self, time):
+        """Returns the list of intervals containing given Time."""
+
+        return self.overlap(time, time)
+
+
+
+    def __iter__(self):
+        """Iterates over all intervals, sorted by start, then by end."""
+
+        stack = []
+        node = self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield (node.start, node.end)
+            node = node.right
+
+
+
+    def __len__(self):
+        """Returns the number of intervals in the index."""
+
+        return self._len
+
+
+
+    def __repr__(self):
+        """Returns string representation of calling TimeIntervalIndex."""
+
+        return "TimeIntervalIndex({})".format(list(self))
+
+
+
 # -------------------------------- TEST SCRIPT --------------------------------
 
 import misctest as mt  # custom functions to make tests easier
@@ -256,4 +571,62 @@ print("Comparison 'time_1 != time_1': ", time_1 != time_1)
 print("Comparison 'time_1 >= time_1': ", time_1 >= time_1)
 print("Comparison 'time_1 <= time_1': ", time_1 <= time_1)
 print("Comparison 'time_1 >= time_2': ", time_1 >= time_2)
-print("Comparison 'time_1 <= time_2': ", time_1 <= time_2)
\ No newline at end of file
+print("Comparison 'time_1 <= time_2': ", time_1 <= time_2)
+
+mt.stepprint("Testing comparison bugfix")
+time_3 = Time(2, 30, 0)
+time_4 = Time(1, 45, 10)
+print("Comparison '{} > {}': ".format(time_4, time_3), time_4 > time_3)
+
+mt.stepprint("Testing hashing")
+print("Set of Time objects:", {time_1, Time(3, 45, 0), time_2})
+agenda = {time_1: "meeting", time_2: "lunch"}
+print("Dict lookup 'agenda[Time(3, 45, 0)]': ", agenda[Time(3, 45, 0)])
+
+mt.stepprint("Sorting Time objects")
+times = [time_1, time_2, time_3, time_4, -1 - time_2]
+print("Output of sorted(times):", sorted(times))
+print("Output of sorted(times, key=Time.sort_key):",
+        sorted(times, key=Time.sort_key))
+
+import timeit
+
+times = [Time(random.randrange(24), random.randrange(60), random.randrange(60))
+        for _ in range(10**5)]
+for (label, key) in (("no key", None), ("key=Time.sort_key", Time.sort_key)):
+    duration = timeit.timeit(lambda: sorted(times, key=key), number=3) / 3
+    print("Sorting {} Time objects ({}): {:.3f} s".format(
+            len(times), label, duration))
+
+mt.stepprint("Indexing Time intervals")
+meetings = TimeIntervalIndex([(Time(9, 0, 0), Time(10, 30, 0)),
+                              (Time(10, 0, 0), Time(11, 0, 0)),
+                              (Time(14, 0, 0), Time(15, 0, 0))])
+print(meetings)
+print("Intervals containing 10:15:00:", meetings.stab(Time(10, 15, 0)))
+print("Intervals overlapping [10:45:00, 14:00:00]:",
+        meetings.overlap(Time(10, 45, 0), Time(14, 0, 0)))
+meetings.insert(Time(13, 0, 0), Time(17, 0, 0))
+meetings.remove(Time(9, 0, 0), Time(10, 30, 0))
+print("After insert and remove:", meetings)
+print("Intervals containing 14:30:00:", meetings.stab(Time(14, 30, 0)))
+
+pairs = []
+for _ in range(10**5):
+    start = random.randrange(24*3600 - 600)
+    pairs.append((Time(0, 0, start), Time(0, 0, start + random.randrange(600))))
+pairs.sort(key=lambda pair: (pair[0].sort_key(), pair[1].sort_key()))
+index = TimeIntervalIndex.from_sorted(pairs)
+queries = [Time(0, 0, random.randrange(24*3600)) for _ in range(20)]
+assert all(index.stab(time) == [pair for pair in pairs
+                                if pair[0] <= time <= pair[1]]
+           for time in queries[:5])
+duration = timeit.timeit(lambda: [index.stab(time) for time in queries],
+        number=1)
+print("{} stabbing queries over {} intervals (index): {:.4f} s".format(
+        len(queries), len(index), duration))
+duration = timeit.timeit(lambda: [[pair for pair in pairs
+                                   if pair[0] <= time <= pair[1]]
+                                  for time in queries], number=1)
+print("{} stabbing queries over {} intervals (scan): {:.4f} s".format(
+        len(queries), len(pairs), duration))
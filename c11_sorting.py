@@ -7,6 +7,8 @@
 # sorted() is effective.
 # Some container classes may also implement their own methods, such as 
 # list.sort().
+# Examples only run when this script is the main program (see EXTERNAL MERGE
+# SORT).
 
 
 import misctest as mt # custom functions to make tests easier
@@ -14,45 +16,48 @@ import misctest as mt # custom functions to make tests easier
 
 #%% ============================= SORTING LISTS ===============================
 
-mt.headprint("SORTING LISTS")
+if __name__ == "__main__":
+    mt.headprint("SORTING LISTS")
 
-# ------------------------------ LIST OF STRINGS ------------------------------
+    # ---------------------------- LIST OF STRINGS ----------------------------
 
-mt.sectprint("LIST OF STRINGS")
+    mt.sectprint("LIST OF STRINGS")
 
-str_list = ["Bernie", "Albert", "Alice", "Caleb", "Aaron"]
-print("Original state:", str_list)
+    str_list = ["Bernie", "Albert", "Alice", "Caleb", "Aaron"]
+    print("Original state:", str_list)
 
-print("\nOutput of sorted(list):", sorted(str_list))
-print("Current state:", str_list)
+    print("\nOutput of sorted(list):", sorted(str_list))
+    print("Current state:", str_list)
 
-print("\nOutput of sorted(list, reverse=True):", sorted(str_list,reverse=True))
-print("Current state:", str_list)
+    print("\nOutput of sorted(list, reverse=True):",
+          sorted(str_list,reverse=True))
+    print("Current state:", str_list)
 
-print("\nOutput of list.sort():", str_list.sort())
-print("Current state:", str_list)
+    print("\nOutput of list.sort():", str_list.sort())
+    print("Current state:", str_list)
 
-print("\nOutput of list.sort(reverse=True):", str_list.sort(reverse=True))
-print("Current state:", str_list)
+    print("\nOutput of list.sort(reverse=True):", str_list.sort(reverse=True))
+    print("Current state:", str_list)
 
-# ------------------------------ LIST OF NUMBERS ------------------------------
+    # ---------------------------- LIST OF NUMBERS ----------------------------
 
-mt.sectprint("LIST OF NUMBERS")
+    mt.sectprint("LIST OF NUMBERS")
 
-num_list = [56, -7, 93.44, 93.23, -42]
-print("Original state:", num_list)
+    num_list = [56, -7, 93.44, 93.23, -42]
+    print("Original state:", num_list)
 
-print("\nOutput of sorted(list):", sorted(num_list))
-print("Current state:", num_list)
+    print("\nOutput of sorted(list):", sorted(num_list))
+    print("Current state:", num_list)
 
-print("\nOutput of sorted(list, reverse=True):", sorted(num_list,reverse=True))
-print("Current state:", num_list)
+    print("\nOutput of sorted(list, reverse=True):",
+          sorted(num_list,reverse=True))
+    print("Current state:", num_list)
 
-print("\nOutput of list.sort():", num_list.sort())
-print("Current state:", num_list)
+    print("\nOutput of list.sort():", num_list.sort())
+    print("Current state:", num_list)
 
-print("\nOutput of list.sort(reverse=True):", num_list.sort(reverse=True))
-print("Current state:", num_list)
+    print("\nOutput of list.sort(reverse=True):", num_list.sort(reverse=True))
+    print("Current state:", num_list)
 
 
 
@@ -67,18 +72,19 @@ print("Current state:", num_list)
 
 #%% ============================ SORTING TUPLES ===============================
 
-mt.headprint("SORTING TUPLES")
+if __name__ == "__main__":
+    mt.headprint("SORTING TUPLES")
 
-num_tup = (56, -7, 93.44, 93.23, -42)
-print("Original state:", num_tup)
+    num_tup = (56, -7, 93.44, 93.23, -42)
+    print("Original state:", num_tup)
 
-print("\nOutput of sorted(tuple):", sorted(num_tup))
-print("Current state:", num_tup)
-try:
-    print("\nOutput of tuple.sort():", num_tup.sort())
-except AttributeError as err:
-    print("\nERROR:", err)
-print("Current state:", num_tup)
+    print("\nOutput of sorted(tuple):", sorted(num_tup))
+    print("Current state:", num_tup)
+    try:
+        print("\nOutput of tuple.sort():", num_tup.sort())
+    except AttributeError as err:
+        print("\nERROR:", err)
+    print("Current state:", num_tup)
 
 
 
@@ -92,42 +98,44 @@ print("Current state:", num_tup)
 
 import operator
 
-mt.headprint("SORTING CUSTOM OBJECTS")
+if __name__ == "__main__":
+    mt.headprint("SORTING CUSTOM OBJECTS")
 
 
-# ----------------------- CUSTOM OBJECT: LIST OF LISTS ------------------------
+    # --------------------- CUSTOM OBJECT: LIST OF LISTS ----------------------
 
-mt.sectprint("LIST OF LISTS")
+    mt.sectprint("LIST OF LISTS")
 
-purchase = [
-    # Item, Unit price, Quantity
-    ["hammer", 10, 1],
-    ["nail", 0.1, 50],
-    ["saw", 40, 1],
-    ["brush", 5, 2],
-    ["paint", 20, 3]
-]
+    purchase = [
+        # Item, Unit price, Quantity
+        ["hammer", 10, 1],
+        ["nail", 0.1, 50],
+        ["saw", 40, 1],
+        ["brush", 5, 2],
+        ["paint", 20, 3]
+    ]
 
-print("Original state:\n", purchase)
-print("Standard sorting:\n", sorted(purchase))
-print("Sorting using column #1 as key:")
-print(sorted(purchase, key=operator.itemgetter(1)))
-print("Sorting using column #2 as key:")
-print(sorted(purchase, key=lambda record:record[2]))
+    print("Original state:\n", purchase)
+    print("Standard sorting:\n", sorted(purchase))
+    print("Sorting using column #1 as key:")
+    print(sorted(purchase, key=operator.itemgetter(1)))
+    print("Sorting using column #2 as key:")
+    print(sorted(purchase, key=lambda record:record[2]))
 
 
-# CONCLUSIONS:
-# - By default, the sorting key is the first column (column #0).
-# - The sorting key can be changed with optional argument 'key=...'.
-#   The key is a function that retrieves the items from the object.
-#   Here we can use 'operator.itemgetter(idx)' or 'lambda record:record[idx]',
-#   where 'idx' is the index of the column we want to use for sorting.
+    # CONCLUSIONS:
+    # - By default, the sorting key is the first column (column #0).
+    # - The sorting key can be changed with optional argument 'key=...'.
+    #   The key is a function that retrieves the items from the object.
+    #   Here we can use 'operator.itemgetter(idx)' or
+    #   'lambda record:record[idx]', where 'idx' is the index of the column we
+    #   want to use for sorting.
 
 
 
-# ----------------- CUSTOM OBJECT: LIST OF CUSTOM CONTAINERS ------------------
+    # --------------- CUSTOM OBJECT: LIST OF CUSTOM CONTAINERS ----------------
 
-mt.sectprint("LIST OF CUSTOM CONTAINERS")
+    mt.sectprint("LIST OF CUSTOM CONTAINERS")
 
 
 class Entry:
@@ -142,46 +150,48 @@ class Entry:
                 self.item, self.price, self.quantity)
 
 
-purchase = [ # List of Entry object
-    Entry("hammer", 10, 1),
-    Entry("nail", 0.1, 50),
-    Entry("saw", 30, 1),
-    Entry("brush", 5, 2),
-    Entry("paint", 30, 3)
-]
+if __name__ == "__main__":
+    purchase = [ # List of Entry object
+        Entry("hammer", 10, 1),
+        Entry("nail", 0.1, 50),
+        Entry("saw", 30, 1),
+        Entry("brush", 5, 2),
+        Entry("paint", 30, 3)
+    ]
 
 
-# >> SORT WITH ONE KEY:
-mt.stepprint("SORT WITH ONE KEY")
+    # >> SORT WITH ONE KEY:
+    mt.stepprint("SORT WITH ONE KEY")
 
-print("Original state:")
-print(purchase)
+    print("Original state:")
+    print(purchase)
 
-print("Standard sorting:")
-try:
-    print(sorted(purchase))
-except TypeError as err:
-    print("ERROR:", err)
+    print("Standard sorting:")
+    try:
+        print(sorted(purchase))
+    except TypeError as err:
+        print("ERROR:", err)
 
-print("Sorting using attribute 'item' as key (attrgetter):")
-print(sorted(purchase, key=operator.attrgetter("item")))
+    print("Sorting using attribute 'item' as key (attrgetter):")
+    print(sorted(purchase, key=operator.attrgetter("item")))
 
-print("Sorting using attribute 'price' as key (lambda):")
-print(sorted(purchase, key=lambda entry:entry.price))
+    print("Sorting using attribute 'price' as key (lambda):")
+    print(sorted(purchase, key=lambda entry:entry.price))
 
 
-# >> SORT WITH MULTIPLE KEYS:
-mt.stepprint("SORT WITH MULTIPLE KEYS")
+    # >> SORT WITH MULTIPLE KEYS:
+    mt.stepprint("SORT WITH MULTIPLE KEYS")
 
-print("Original state:")
-print(purchase)
+    print("Original state:")
+    print(purchase)
 
-print("Sorting (attrgetter):") # List keys by descending order of importance
-print(sorted(purchase, key=operator.attrgetter("price", "quantity")))
+    print("Sorting (attrgetter):") # List keys by descending order of
+                                   # importance
+    print(sorted(purchase, key=operator.attrgetter("price", "quantity")))
 
-print("Sorting (lambda):") # Process keys by ascending order of importance
-print(sorted(sorted(purchase, key=lambda entry:entry.quantity), 
-    key=lambda entry:entry.price))
+    print("Sorting (lambda):") # Process keys by ascending order of importance
+    print(sorted(sorted(purchase, key=lambda entry:entry.quantity), 
+        key=lambda entry:entry.price))
 
 
 
@@ -201,9 +211,1149 @@ print(sorted(sorted(purchase, key=lambda entry:entry.quantity),
 # We may also sort by ascending order of images by given lambda function.
 # Here let us try with x -> 1/x.
 
-mt.headprint("ADVANCED SORTING")
+if __name__ == "__main__":
+    mt.headprint("ADVANCED SORTING")
+
+    num_list = [56, -7, 93.44, 93.23, -42]
+
+    print("Original state:", num_list)
+    print("Output of sorted(list) ; key x:1/x :",
+          sorted(num_list, key=lambda x:1/x))
+
+
+#%% ========================== MULTIPLE KEYS SORTING ==========================
+
+import itertools
+
+# Chaining one-key sorts (see above) sorts the list once per key, and calls a
+# lambda function for each element at each pass. Instead, we can compute one
+# composite key per element, once, and sort in a single pass. This is known
+# as the "Schwartzian transform" (decorate, sort, undecorate).
+# Here each column is replaced by the ranks of its values (only distinct
+# values are sorted), ranks are reversed for descending orders, and ranks of
+# all columns are packed into a single integer per element, like digits of a
+# number. Comparing integers is much faster than comparing tuples.
+
+
+
+def _rank_encode(values):
+    """Returns the list of ranks of given values among distinct values
+    (0 for the lowest one), and the number of distinct values."""
+
+    ranks = {value: rank for (rank, value) in enumerate(sorted(set(values)))}
+    return (list(map(ranks.__getitem__, values)), len(ranks))
+
+
+
+def multisort(seq, spec):
+    """Returns a new list of the items of given sequence, sorted according to
+    given spec: list of (attribute, direction) pairs, by descending order of
+    importance, direction being 'asc' or 'desc'. The sort is stable."""
+
+    if not spec: # check input
+        raise ValueError("spec must contain at least one key")
+
+    items = list(seq)
+    keys = itertools.repeat(0)
+    for (attr, direction) in spec:
+        if direction not in ("asc", "desc"): # check input
+            raise ValueError("invalid direction '{}'".format(direction))
+        column = map(operator.attrgetter(attr), items) # loops in C
+        (ranks, count) = _rank_encode(list(column))
+        if direction == "desc": # reverse ranks: count-1-rank
+            ranks = map(operator.sub, itertools.repeat(count - 1), ranks)
+        keys = list(map(operator.add, # keys = keys * count + ranks
+                map(operator.mul, keys, itertools.repeat(count)), ranks))
+
+    order = sorted(range(len(items)), key=keys.__getitem__) # single pass
+    return list(map(items.__getitem__, order))
+
+
+
+if __name__ == "__main__":
+    mt.headprint("MULTIPLE KEYS SORTING")
+    mt.stepprint("Sort with mixed orders")
+
+    purchase = [
+        Entry("hammer", 10, 1),
+        Entry("nail", 0.1, 50),
+        Entry("saw", 30, 1),
+        Entry("brush", 5, 2),
+        Entry("paint", 30, 3),
+        Entry("glue", 5, 2)
+    ]
+
+    print("Original state:")
+    print(purchase)
+    print("Sorting (price asc, quantity desc, item asc):")
+    print(multisort(purchase, [("price", "asc"), ("quantity", "desc"),
+                               ("item", "asc")]))
+    print("Sorting (item desc):")
+    print(multisort(purchase, [("item", "desc")]))
+
+
+    mt.stepprint("Benchmark")
+
+import random
+import timeit
+
+if __name__ == "__main__":
+    ITEMS = ["item{}".format(idx) for idx in range(1000)]
+    entries = [Entry(random.choice(ITEMS), random.randrange(100),
+                     random.randrange(100)) for _ in range(10**5)]
+
+def chained_sort(entries):
+    """Sorts by price asc, quantity desc, item asc, chaining sorts."""
+
+    result = sorted(entries, key=lambda entry: entry.item)
+    result = sorted(result, key=lambda entry: entry.quantity, reverse=True)
+    return sorted(result, key=lambda entry: entry.price)
+
+if __name__ == "__main__":
+    SPEC = [("price", "asc"), ("quantity", "desc"), ("item", "asc")]
+    assert chained_sort(entries) == multisort(entries, SPEC)
+    for (label, function) in (("chained lambdas", chained_sort),
+                              ("multisort", lambda seq: multisort(seq, SPEC))):
+        duration = timeit.timeit(lambda: function(entries), number=3) / 3
+        print("Sorting {} entries ({}): {:.3f} s".format(len(entries), label,
+                                                          duration))
+
+
+
+# CONCLUSIONS:
+# - A composite key computed once per element allows sorting with any mix of
+#   orders in a single pass.
+# - Using functions of module 'operator' with map() builds the keys in C code,
+#   without calling a Python function for each element.
+
+
+
+#%% ============================== COLUMNAR TABLE =============================
+
+# A list of Entry objects is an "array of structures": sorting it moves
+# objects around and reads attributes through each object. If we sort the
+# same data by different columns again and again, we can instead store each
+# attribute in its own typed array (a "structure of arrays"), and sort
+# permutations (lists of row indexes) rather than rows.
+# Strings are "dictionary-encoded": each distinct item is stored once, and
+# the column only holds integer codes.
+
+from array import array # typed arrays: 'l' for int, 'd' for float, etc.
+
+
+
+class EntryTable:
+    """Table of entries stored as columns: 'item' (codes of strings listed
+    in 'items'), 'price' (floats) and 'quantity' (integers)."""
+
+
+    def __init__(self, entries=()):
+        """Creates EntryTable instance from given Entry objects."""
+
+        self.items = [] # code -> item
+        self._codes = dict() # item -> code
+        self.item = array("l")
+        self.price = array("d")
+        self.quantity = array("q")
+        self.extend(entries)
+
+
+    def append(self, entry):
+        """Adds given Entry object as a new row."""
+
+        code = self._codes.get(entry.item)
+        if code is None: # new item
+            code = self._codes[entry.item] = len(self.items)
+            self.items.append(entry.item)
+        self.item.append(code)
+        self.price.append(entry.price)
+        self.quantity.append(entry.quantity)
+
+
+    def extend(self, entries):
+        """Adds given Entry objects as new rows."""
+
+        for entry in entries:
+            self.append(entry)
+
+
+    def __len__(self):
+        """Returns the number of rows."""
+
+        return len(self.item)
+
+
+    def row(self, idx):
+        """Returns row at given index as an Entry object."""
+
+        return Entry(self.items[self.item[idx]], self.price[idx],
+                     self.quantity[idx])
+
+
+    def take(self, perm):
+        """Returns rows at given indexes as a list of Entry objects."""
+
+        return [self.row(idx) for idx in perm]
+
+
+    def sortkey(self, name):
+        """Returns values of column which name is given, in an order
+        suitable for sorting."""
+
+        if name == "item": # codes follow insertion order, not alphabetical
+            (ranks, _) = _rank_encode(self.items) # rank of each code
+            return list(map(ranks.__getitem__, self.item))
+        if name in ("price", "quantity"):
+            return getattr(self, name)
+        raise ValueError("unknown column '{}'".format(name))
+
+
+    def argsort(self, name, reverse=False):
+        """Returns the permutation (array of row indexes) which sorts column
+        which name is given. The sort is stable."""
+
+        key = self.sortkey(name)
+        return array("q", sorted(range(len(self)), key=key.__getitem__,
+                                 reverse=reverse))
+
+
+    def lexsort(self, spec):
+        """Returns the permutation (array of row indexes) which sorts rows
+        according to given spec: list of (column, direction) pairs, by
+        descending order of importance, direction being 'asc' or 'desc'."""
+
+        perm = list(range(len(self)))
+        for (name, direction) in reversed(spec): # least important key first
+            if direction not in ("asc", "desc"): # check input
+                raise ValueError("invalid direction '{}'".format(direction))
+            perm.sort(key=self.sortkey(name).__getitem__,
+                      reverse=(direction == "desc"))
+                # Each pass is stable, so ties keep the order set by the
+                # previous (less important) keys.
+        return array("q", perm)
+
+
+
+if __name__ == "__main__":
+    mt.headprint("COLUMNAR TABLE")
+    mt.stepprint("Build table")
+    table = EntryTable(purchase)
+    print("Items:", table.items)
+    print("Column 'item':", table.item)
+    print("Column 'price':", table.price)
+    print("Column 'quantity':", table.quantity)
+
+    mt.stepprint("Sort table")
+    perm = table.argsort("item")
+    print("Permutation sorting by item:", perm)
+    print(table.take(perm))
+    perm = table.lexsort([("price", "asc"), ("quantity", "desc"),
+                          ("item", "asc")])
+    print("Permutation sorting by price asc, quantity desc, item asc:", perm)
+    print(table.take(perm))
+
+
+    mt.stepprint("Benchmark")
+
+    table = EntryTable(entries)
+    assert ([(entry.item, entry.price, entry.quantity)
+             for entry in table.take(table.lexsort(SPEC))]
+            == [(entry.item, entry.price, entry.quantity)
+                for entry in multisort(entries, SPEC)])
+    for (label, function) in (
+            ("list of Entry, multisort", lambda: multisort(entries, SPEC)),
+            ("EntryTable, lexsort", lambda: table.lexsort(SPEC))):
+        duration = timeit.timeit(function, number=3) / 3
+        print("Sorting {} entries ({}): {:.3f} s".format(len(entries), label,
+                                                          duration))
+
+
+
+# CONCLUSIONS:
+# - Storing columns in typed arrays and sorting permutations avoids moving
+#   (or even reading) row objects when re-sorting.
+# - Dictionary-encoded strings are compared as integers once their codes are
+#   replaced by ranks.
+
+
+
+#%% =========================== EXTERNAL MERGE SORT ===========================
+
+# Function sorted() needs the whole list in memory. To sort more records than
+# memory can hold, we can:
+#   1/ read records as a stream, and cut it into "runs" of fixed size,
+#   2/ sort each run (in parallel, in other processes) and write it to a
+#      temporary file,
+#   3/ merge the sorted runs with heapq.merge(), which reads only one record
+#      at a time from each run.
+# Memory then holds at most one run per worker process, plus one record per
+# run during the merge.
+# Runs are written with module 'marshal', a compact binary format for basic
+# types (here one tuple per record).
+
+import heapq
+import marshal
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+
+
+def _sort_run(records, keys, reverse, directory):
+    """Sorts given (item, price, quantity) tuples by given attributes, and
+    writes them to a new file in given directory. Returns path of the file.
+    Runs in a worker process."""
+
+    entries = [Entry(*record) for record in records]
+    entries.sort(key=operator.attrgetter(*keys), reverse=reverse)
+    (fd, path) = tempfile.mkstemp(suffix=".run", dir=directory)
+    with open(fd, "wb") as runfile:
+        runfile.write(b"".join(
+            marshal.dumps((entry.item, entry.price, entry.quantity))
+            for entry in entries))
+    return path
+
+
+
+def _read_run(path):
+    """Iterates over Entry objects stored in run file at given path, then
+    deletes the file."""
+
+    try:
+        with open(path, "rb") as runfile:
+            while True:
+                try:
+                    record = marshal.load(runfile) # reads one record
+                except EOFError:
+                    break
+                yield Entry(*record)
+    finally:
+        os.remove(path)
+
+
+
+def external_sort(entries, keys=("price", "quantity"), reverse=False,
+                  run_size=100000, workers=None, directory=None):
+    """Iterates over given Entry objects (any iterable), sorted by given
+    attribute(s), as operator.attrgetter() would take them. Sorts runs of
+    'run_size' entries in 'workers' processes, and writes them in a
+    temporary directory (inside given directory, if any)."""
+
+    keys = (keys,) if isinstance(keys, str) else tuple(keys)
+    workers = workers or os.cpu_count()
+    entries = iter(entries)
+
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        futures = [] # one per run, in input order (keeps the sort stable)
+        with ProcessPoolExecutor(workers) as pool:
+            pending = set()
+            while True:
+                run = [(entry.item, entry.price, entry.quantity)
+                       for entry in itertools.islice(entries, run_size)]
+                if not run:
+                    break
+                if len(pending) >= workers: # bounds memory: waits for a
+                    (_, pending) = wait(pending, # worker to be available
+                                        return_when=FIRST_COMPLETED)
+                future = pool.submit(_sort_run, run, keys, reverse, tmpdir)
+                futures.append(future)
+                pending.add(future)
+            paths = [future.result() for future in futures]
+
+        yield from heapq.merge(*map(_read_run, paths),
+                               key=operator.attrgetter(*keys),
+                               reverse=reverse)
+
+
+
+# NB: Worker processes may have to run this script again (with the "spawn"
+# start method of 'multiprocessing', the default on Windows and macOS), under
+# the name '__mp_main__'. This is why all examples and benchmarks of this
+# script only run when 'if __name__ == "__main__"': workers only get the
+# definitions. Moving the worker functions to another module would not be
+# enough, as the main script is run again anyway.
+
+if __name__ == "__main__":
+    mt.headprint("EXTERNAL MERGE SORT")
+
+    mt.stepprint("Sort a stream of entries")
+
+    def stream(count):
+        """Yields given number of random entries (as if read from a file)."""
+
+        for _ in range(count):
+            yield Entry(random.choice(ITEMS), random.randrange(100),
+                        random.randrange(100))
+
+    random.seed(0)
+    start = timeit.default_timer()
+    result = [(entry.item, entry.price, entry.quantity) for entry
+              in external_sort(stream(2*10**5), run_size=20000)]
+    duration = timeit.default_timer() - start
+    random.seed(0)
+    expected = [(entry.item, entry.price, entry.quantity) for entry
+                in sorted(stream(2*10**5),
+                          key=operator.attrgetter("price", "quantity"))]
+    print("Same result as sorted():", result == expected)
+    print("Sorting {} entries by runs of {}: {:.3f} s".format(
+            len(result), 20000, duration))
+
+
+
+# CONCLUSIONS:
+# - An external sort only keeps a bounded number of records in memory, at the
+#   cost of writing and reading every record once.
+# - heapq.merge() merges sorted iterables lazily (it is a generator).
+
+
+
+#%% ========================== SORTED CONTAINER ===============================
 
-num_list = [56, -7, 93.44, 93.23, -42]
+# Sorting the whole list again after each insertion costs O(n log n) each
+# time. A sorted container keeps its elements sorted as they are inserted.
+# Inserting into one big sorted list (bisect.insort) is O(n), since all
+# following elements are moved. Here elements are stored in a list of small
+# sorted blocks: finding the right block and the right place in it is done by
+# binary search (module 'bisect'), and only the elements of one block are
+# moved. Blocks are split when they get too big.
+# The keys of elements are computed once, and stored alongside.
 
-print("Original state:", num_list)
-print("Output of sorted(list) ; key x:1/x :", sorted(num_list, key=lambda x:1/x))
\ No newline at end of file
+import bisect
+
+
+
+class SortedEntries:
+    """Container keeping Entry objects sorted by given key function (by
+    default by price). Entries with equal keys keep their insertion order."""
+
+    _BLOCK = 512 # blocks are split in two when they exceed twice this size
+
+
+    def __init__(self, entries=(), key=operator.attrgetter("price")):
+        """Creates SortedEntries instance containing given Entry objects."""
+
+        self.key = key
+        entries = sorted(entries, key=key)
+        keys = list(map(key, entries))
+        size = self._BLOCK
+        self._blocks = [entries[idx:idx+size]
+                        for idx in range(0, len(entries), size)]
+        self._keys = [keys[idx:idx+size] for idx in range(0, len(keys), size)]
+        self._maxes = [block[-1] for block in self._keys] # last key by block
+        self._starts = None # index of first entry by block (computed lazily)
+
+
+    def __len__(self):
+        """Returns the number of entries."""
+
+        return sum(map(len, self._blocks))
+
+
+    def __iter__(self):
+        """Iterates over entries, by ascending order of keys."""
+
+        return itertools.chain.from_iterable(self._blocks)
+
+
+    def __repr__(self):
+        return "SortedEntries({})".format(list(self))
+
+
+    def insert(self, entry):
+        """Adds given Entry object, in O(log n) comparisons."""
+
+        key = self.key(entry)
+        self._starts = None
+        if not self._blocks: # first entry
+            self._blocks.append([entry])
+            self._keys.append([key])
+            self._maxes.append(key)
+            return
+        idx = bisect.bisect_right(self._maxes, key)
+        if idx == len(self._maxes): # new greatest key: goes to last block
+            idx -= 1
+            self._maxes[idx] = key
+        pos = bisect.bisect_right(self._keys[idx], key) # after equal keys
+        self._blocks[idx].insert(pos, entry)
+        self._keys[idx].insert(pos, key)
+        if len(self._blocks[idx]) > 2 * self._BLOCK: # split block
+            half = self._BLOCK
+            self._blocks[idx+1:idx+1] = [self._blocks[idx][half:]]
+            self._keys[idx+1:idx+1] = [self._keys[idx][half:]]
+            del self._blocks[idx][half:]
+            del self._keys[idx][half:]
+            self._maxes.insert(idx, self._keys[idx][-1])
+
+
+    def remove(self, entry):
+        """Removes given Entry object, in O(log n) comparisons (plus the
+        number of other entries with the same key).
+        Raises ValueError if it is not in the container."""
+
+        key = self.key(entry)
+        idx = bisect.bisect_left(self._maxes, key)
+        while idx < len(self._blocks) and self._keys[idx][0] <= key:
+            keys = self._keys[idx]
+            pos = bisect.bisect_left(keys, key)
+            end = bisect.bisect_right(keys, key, pos)
+            for pos in range(pos, end):
+                if self._blocks[idx][pos] == entry:
+                    del self._blocks[idx][pos]
+                    del keys[pos]
+                    if keys:
+                        self._maxes[idx] = keys[-1]
+                    else: # empty block
+                        del self._blocks[idx], self._keys[idx]
+                        del self._maxes[idx]
+                    self._starts = None
+                    return
+            idx += 1
+        raise ValueError("{!r} not in container".format(entry))
+
+
+    def __getitem__(self, idx):
+        """Returns the entry at given index (k-th smallest key), in O(1) for
+        the first and last entries, and O(log n) otherwise."""
+
+        if idx == 0 and self._blocks:
+            return self._blocks[0][0]
+        if idx == -1 and self._blocks:
+            return self._blocks[-1][-1]
+        if self._starts is None: # cumulative sizes of blocks
+            self._starts = list(itertools.accumulate(
+                    map(len, self._blocks), initial=0))
+        size = self._starts[-1]
+        if idx < 0:
+            idx += size
+        if not 0 <= idx < size: # check input
+            raise IndexError("index out of range")
+        block = bisect.bisect_right(self._starts, idx) - 1
+        return self._blocks[block][idx - self._starts[block]]
+
+
+    def min(self):
+        """Returns the entry with the lowest key."""
+
+        return self[0]
+
+
+    def max(self):
+        """Returns the entry with the greatest key."""
+
+        return self[-1]
+
+
+    def irange(self, low, high):
+        """Iterates over entries which key is in [low, high], by ascending
+        order of keys."""
+
+        idx = bisect.bisect_left(self._maxes, low)
+        if idx == len(self._blocks):
+            return
+        pos = bisect.bisect_left(self._keys[idx], low)
+        for (block, keys) in zip(self._blocks[idx:], self._keys[idx:]):
+            end = bisect.bisect_right(keys, high, pos)
+            yield from block[pos:end]
+            if end < len(keys): # reached a key greater than high
+                return
+            pos = 0
+
+
+
+if __name__ == "__main__":
+    mt.headprint("SORTED CONTAINER")
+    mt.stepprint("Insert and query")
+
+    container = SortedEntries(purchase[:3])
+    for entry in purchase[3:]:
+        container.insert(entry)
+    print(container)
+    print("Min:", container.min(), "| Max:", container.max(),
+          "| 3rd:", container[2])
+    print("Price in [5, 20]:", list(container.irange(5, 20)))
+    container.remove(purchase[0])
+    print("After removing {}:".format(purchase[0]), container)
+
+
+    mt.stepprint("Benchmark")
+
+# Each step inserts 100 entries, then reads the 10 cheapest ones.
+def resort_steps(entries):
+    """Keeps a list sorted by sorting it again after each step."""
+
+    result = []
+    for idx in range(0, len(entries), 100):
+        result.extend(entries[idx:idx+100])
+        result.sort(key=operator.attrgetter("price"))
+        result[:10]
+    return result
+
+def container_steps(entries):
+    """Keeps a SortedEntries container sorted."""
+
+    result = SortedEntries()
+    for idx in range(0, len(entries), 100):
+        for entry in entries[idx:idx+100]:
+            result.insert(entry)
+        list(itertools.islice(result, 10))
+    return result
+
+if __name__ == "__main__":
+    inserted = entries[:2*10**4]
+    container = container_steps(inserted)
+    assert list(container) == resort_steps(inserted)
+    assert [container[idx] for idx in range(0, len(inserted), 999)] == \
+        sorted(inserted, key=operator.attrgetter("price"))[::999]
+    assert list(container.irange(5, 20)) == [
+        entry for entry in resort_steps(inserted) if 5 <= entry.price <= 20]
+    for entry in inserted[::2]:
+        container.remove(entry)
+    assert list(container) == sorted(inserted[1::2],
+                                     key=operator.attrgetter("price"))
+    for (label, function) in (("sort after each step", resort_steps),
+                              ("SortedEntries", container_steps)):
+        duration = timeit.timeit(lambda: function(inserted), number=1)
+        print("Inserting {} entries by steps of 100 ({}): {:.3f} s".format(
+                len(inserted), label, duration))
+
+
+
+# CONCLUSIONS:
+# - A list of sorted blocks keeps insertions cheap: binary searches find the
+#   place, and only one small block is moved.
+# - Module 'bisect' provides binary search on sorted lists.
+
+
+
+#%% ================================ TOP K ====================================
+
+# When only the first k elements of a sorted list are needed, sorting all n
+# elements (O(n log n)) is wasted work. Functions heapq.nsmallest() and
+# heapq.nlargest() read the input once and keep only the k best elements in
+# a heap, in O(n log k). Their result is the same as sorted(...)[:k],
+# including the order of ties.
+# Mixed orders (see multisort) cannot be handled by reverse=True alone, since
+# the input is streamed: the key of a descending column is wrapped in an
+# object which comparison is reversed.
+
+
+
+class _Descending:
+    """Wrapper of a value, which compares in reverse order."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+
+def spec_key(spec):
+    """Returns a key function sorting Entry objects according to given spec:
+    list of (attribute, direction) pairs, as for multisort()."""
+
+    if not spec: # check input
+        raise ValueError("spec must contain at least one key")
+    for (_, direction) in spec:
+        if direction not in ("asc", "desc"): # check input
+            raise ValueError("invalid direction '{}'".format(direction))
+    if all(direction == "asc" for (_, direction) in spec):
+        return operator.attrgetter(*[attr for (attr, _) in spec]) # C code
+    getters = [(operator.attrgetter(attr), direction == "desc")
+               for (attr, direction) in spec]
+
+    def key(entry):
+        return tuple(_Descending(getter(entry)) if desc else getter(entry)
+                     for (getter, desc) in getters)
+    return key
+
+
+
+def top_k(iterable, k, key=None, reverse=True):
+    """Returns the list of the first k elements of sorted(iterable, key=key,
+    reverse=reverse), in O(n log k). Key may be a function, or a spec for
+    spec_key() (list or tuple)."""
+
+    if key is not None and not callable(key):
+        key = spec_key(key)
+    if reverse:
+        return heapq.nlargest(k, iterable, key=key)
+    return heapq.nsmallest(k, iterable, key=key)
+
+
+
+def nsmallest(iterable, k, key=None):
+    """Returns the list of the k smallest elements of given iterable (see
+    top_k)."""
+
+    return top_k(iterable, k, key=key, reverse=False)
+
+
+
+def parallel_top_k(entries, k, key=None, reverse=True, chunk_size=100000,
+                   workers=None):
+    """Same as top_k(), but chunks of given size are processed in 'workers'
+    processes, then their top k elements are merged. Key must be a spec or
+    a function which can be pickled (e.g. operator.attrgetter)."""
+
+    workers = workers or os.cpu_count()
+    entries = iter(entries)
+    futures = [] # one per chunk, in input order (keeps ties ordered)
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        while True:
+            chunk = list(itertools.islice(entries, chunk_size))
+            if not chunk:
+                break
+            if len(pending) >= workers: # bounds memory
+                (_, pending) = wait(pending, return_when=FIRST_COMPLETED)
+            future = pool.submit(top_k, chunk, k, key, reverse)
+            futures.append(future)
+            pending.add(future)
+        candidates = [future.result() for future in futures]
+    return top_k(itertools.chain.from_iterable(candidates), k, key, reverse)
+
+
+
+if __name__ == "__main__":
+    mt.headprint("TOP K")
+    mt.stepprint("Top k")
+
+    print("3 most expensive entries:")
+    print(top_k(purchase, 3, key=operator.attrgetter("price")))
+    print("3 first entries (price asc, quantity desc, item asc):")
+    print(nsmallest(purchase, 3, key=SPEC))
+    assert nsmallest(purchase, 3, key=tuple(SPEC)) == nsmallest(purchase, 3,
+                                                                key=SPEC)
+
+
+    mt.stepprint("Benchmark")
+
+    many = entries * 10 # 10^6 entries
+    PRICE = operator.attrgetter("price", "quantity")
+    assert top_k(many, 100, key=PRICE) == sorted(many, key=PRICE,
+                                                 reverse=True)[:100]
+    assert nsmallest(many, 100, key=SPEC) == multisort(many, SPEC)[:100]
+    for (label, function) in (
+            ("sorted()[:100]", lambda: sorted(many, key=PRICE,
+                                              reverse=True)[:100]),
+            ("top_k", lambda: top_k(many, 100, key=PRICE))):
+        duration = timeit.timeit(function, number=1)
+        print("Top 100 of {} entries ({}): {:.3f} s".format(len(many), label,
+                                                             duration))
+
+    # Workers return copies of entries: compare their attributes.
+    ROW = operator.attrgetter("item", "price", "quantity")
+    assert (list(map(ROW, parallel_top_k(many, 100, key=PRICE)))
+            == list(map(ROW, top_k(many, 100, key=PRICE))))
+    assert (list(map(ROW, parallel_top_k(many, 100, key=SPEC, reverse=False)))
+            == list(map(ROW, nsmallest(many, 100, key=SPEC))))
+    duration = timeit.timeit(lambda: parallel_top_k(many, 100, key=PRICE),
+                             number=1)
+    print("Top 100 of {} entries (parallel_top_k): {:.3f} s".format(
+            len(many), duration))
+
+
+
+# CONCLUSIONS:
+# - heapq.nsmallest() and heapq.nlargest() only keep k elements, which is
+#   faster than a full sort when k is much smaller than n.
+# - With processes, elements must be pickled to be sent to workers: this may
+#   cost more than the work itself when the key is cheap.
+
+
+
+#%% ============================= KEY COMPILER ================================
+
+# A key given as a lambda function (e.g. key=lambda x: 1/x) costs a call to a
+# Python function for each element. A key may instead be described by data:
+# a list of terms, each one being an attribute name (dotted paths allowed),
+# an item index, None (the element itself), or a tuple (field, transform,
+# ...) where transforms are "neg" (-x) or "inv" (1/x).
+# Such a spec is "compiled" into functions of module 'operator', which run in
+# C code (operator.attrgetter / operator.itemgetter) when there is no
+# transform, or into compositions of such functions otherwise. Function
+# compute_keys() computes all keys at once, with chains of map() in C code.
+# If NumPy is installed, keys of NumPy arrays are computed by vectorized
+# functions instead.
+
+import functools
+import keyword
+
+try:
+    import numpy as np
+except ImportError: # NumPy is optional
+    np = None
+
+
+
+_TRANSFORMS = { # name -> (function on one value, NumPy function name)
+    "neg": (operator.neg, "negative"),
+    "inv": (functools.partial(operator.truediv, 1), "reciprocal"),
+}
+
+
+def _parse_spec(spec):
+    """Returns given key spec as a list of (field, transforms) pairs,
+    transforms being a list of functions names."""
+
+    if not isinstance(spec, list): # single term
+        spec = [spec]
+    if not spec: # check input
+        raise ValueError("spec must contain at least one term")
+    terms = []
+    for term in spec:
+        (field, *transforms) = term if isinstance(term, tuple) else (term,)
+        if field is not None and not isinstance(field, (str, int)):
+            raise TypeError("invalid field {!r}".format(field))
+        if isinstance(field, str) and not all( # check input
+                name.isidentifier() and not keyword.iskeyword(name)
+                for name in field.split(".")):
+            raise ValueError("invalid attribute '{}'".format(field))
+        for name in transforms:
+            if name not in _TRANSFORMS: # check input
+                raise ValueError("unknown transform '{}'".format(name))
+        terms.append((field, transforms))
+    return terms
+
+
+
+def _getter(field):
+    """Returns the function which gets given field of an element."""
+
+    if field is None:
+        return None
+    if isinstance(field, int):
+        return operator.itemgetter(field)
+    return operator.attrgetter(field)
+
+
+
+def _identity(element):
+    """Returns given element."""
+
+    return element
+
+
+
+def _compose(outer, inner):
+    """Returns function x -> outer(inner(x)), or outer if inner is None."""
+
+    if inner is None:
+        return outer
+    return lambda element: outer(inner(element))
+
+
+
+def compile_key(spec):
+    """Returns the key function described by given spec (see above)."""
+
+    terms = _parse_spec(spec)
+    fields = [field for (field, _) in terms]
+    if not any(transforms for (_, transforms) in terms):
+        if all(isinstance(field, str) for field in fields):
+            return operator.attrgetter(*fields) # no Python code at all
+        if all(isinstance(field, int) for field in fields):
+            return operator.itemgetter(*fields)
+
+    # Otherwise, each term is a getter wrapped in its transforms, and terms
+    # are called in turn to build a tuple.
+    functions = []
+    for (field, transforms) in terms:
+        function = _getter(field)
+        for name in transforms:
+            function = _compose(_TRANSFORMS[name][0], function)
+        functions.append(function or _identity)
+    if len(functions) == 1:
+        return functions[0] # e.g. operator.neg for (None, "neg")
+    return lambda element: tuple([function(element)
+                                  for function in functions])
+
+
+
+def compute_keys(spec, seq):
+    """Returns the keys of all elements of given sequence, described by
+    given spec: a list computed by map() chains (in C code), or a NumPy
+    array if seq is a NumPy array (then the spec must be one term, which
+    field is None)."""
+
+    terms = _parse_spec(spec)
+    if np is not None and isinstance(seq, np.ndarray):
+        if len(terms) != 1 or terms[0][0] is not None: # check input
+            raise ValueError("NumPy arrays only support field None")
+        keys = seq
+        for name in terms[0][1]:
+            if name == "inv":
+                keys = keys.astype(float)
+            keys = getattr(np, _TRANSFORMS[name][1])(keys)
+        return keys
+
+    columns = []
+    for (field, transforms) in terms:
+        column = seq if field is None else map(_getter(field), seq)
+        for name in transforms:
+            column = map(_TRANSFORMS[name][0], column)
+        columns.append(column)
+    if len(columns) == 1:
+        return list(columns[0])
+    return list(zip(*columns))
+
+
+
+def sort_by(seq, spec, reverse=False):
+    """Returns the elements of given sequence sorted by keys described by
+    given spec (stable sort). For NumPy arrays, returns a NumPy array."""
+
+    if np is None or not isinstance(seq, np.ndarray):
+        seq = list(seq) # may be an iterator: read it once
+    keys = compute_keys(spec, seq)
+    if np is not None and isinstance(seq, np.ndarray):
+        if reverse: # reversing a stable order would reverse ties too
+            order = len(keys) - 1 - np.argsort(keys[::-1], kind="stable")[::-1]
+        else:
+            order = np.argsort(keys, kind="stable")
+        return seq[order]
+    # Function sorted() calls the key function once per element, in order:
+    # next() on an iterator over precomputed keys is a key function in C.
+    return sorted(seq, key=functools.partial(next, iter(keys)),
+                  reverse=reverse)
+
+
+
+if __name__ == "__main__":
+    mt.headprint("KEY COMPILER")
+    mt.stepprint("Compiled keys")
+
+    print("Original state:", num_list)
+    print("Output of sort_by(list, (None, 'inv')) :",
+          sort_by(num_list, (None, "inv")))
+    print("Sorting purchase by price desc, item:")
+    print(sort_by(purchase, [("price", "neg"), "item"]))
+
+
+    mt.stepprint("Check against lambda functions")
+
+    rows = [(entry.item, entry.price, entry.quantity) for entry in entries]
+    numbers = [random.uniform(-100, 100) or 1. for _ in range(10**5)]
+    CASES = [ # (sequence, spec, equivalent lambda function)
+        (entries, "price", lambda entry: entry.price),
+        (entries, ["price", "item"], lambda entry: (entry.price, entry.item)),
+        (entries, [("quantity", "neg"), "item"],
+         lambda entry: (-entry.quantity, entry.item)),
+        (rows, 1, lambda row: row[1]),
+        (rows, [(2, "neg"), 0], lambda row: (-row[2], row[0])),
+        (numbers, (None, "inv"), lambda x: 1/x),
+        (numbers, (None, "neg", "inv"), lambda x: 1/-x),
+    ]
+    for (seq, spec, function) in CASES:
+        expected = sorted(seq, key=function)
+        assert sorted(seq, key=compile_key(spec)) == expected, spec
+        assert compute_keys(spec, seq) == list(map(function, seq)), spec
+        assert sort_by(seq, spec) == expected, spec
+        assert sort_by(seq, spec, reverse=True) == sorted(
+                seq, key=function, reverse=True), spec
+    if np is not None:
+        array_ = np.array(numbers)
+        assert sort_by(array_, (None, "inv")).tolist() == sorted(
+                numbers, key=lambda x: 1/x)
+        zeros = [0., -0., 1., -0., 0.] # equal keys, different elements
+        for reverse in (False, True): # stable in both directions
+            assert repr(sort_by(np.array(zeros), (None, "neg"),
+                                reverse).tolist()) == repr(
+                    sorted(zeros, key=operator.neg, reverse=reverse))
+    print("{} specs checked: OK".format(len(CASES)))
+
+
+    mt.stepprint("Benchmark")
+
+    for (label, function) in (
+            ("lambda", lambda: sorted(numbers, key=lambda x: 1/x)),
+            ("compile_key", lambda: sorted(numbers,
+                                           key=compile_key((None, "inv")))),
+            ("sort_by", lambda: sort_by(numbers, (None, "inv")))):
+        duration = timeit.timeit(function, number=3) / 3
+        print("Sorting {} numbers by 1/x ({}): {:.3f} s".format(
+                len(numbers), label, duration))
+    for (label, function) in (
+            ("lambda", lambda: sorted(entries, key=lambda entry: (
+                    -entry.quantity, entry.item))),
+            ("compile_key", lambda: sorted(entries, key=compile_key(
+                    [("quantity", "neg"), "item"]))),
+            ("sort_by", lambda: sort_by(entries, [("quantity", "neg"),
+                                                  "item"]))):
+        duration = timeit.timeit(function, number=3) / 3
+        print("Sorting {} entries by -quantity, item ({}): {:.3f} s".format(
+                len(entries), label, duration))
+
+
+
+# CONCLUSIONS:
+# - operator.attrgetter, operator.itemgetter, operator.neg or
+#   functools.partial(operator.truediv, 1) are key functions written in C.
+# - Computing all keys at once with map() avoids calling a Python function
+#   for each element, even when transforms are chained.
+# - A key function composed of several terms still calls Python code for
+#   each element: it is a bit slower than a hand-written lambda, so prefer
+#   sort_by() for such specs.
+
+
+
+#%% ============================ PARALLEL SORT ================================
+
+# Sorting big lists of numbers can use several processes. To avoid sending
+# (pickling) the numbers to workers and back, they are stored as raw doubles
+# in a block of shared memory (module 'multiprocessing.shared_memory'), which
+# each process views as an array through memoryview.cast("d"):
+#   1/ the data is split into one chunk per worker, each worker sorts its
+#      chunk in place,
+#   2/ "splitters" are chosen among samples of the sorted chunks, so that
+#      values between two consecutive splitters form one part of the output,
+#      made of one slice of each chunk (found by binary search),
+#   3/ each worker merges the slices of one part (heapq.merge), and writes
+#      them at their final place in another block of shared memory.
+# The result is copied into an array('d') as raw bytes.
+# With NumPy, workers sort and merge their values as arrays viewing the
+# shared memory. Without it, they still build Python floats to sort and
+# merge their own values: only transfers between processes are avoided.
+
+from multiprocessing import shared_memory
+
+
+
+def _sort_chunk(name, start, stop):
+    """Sorts in place doubles [start:stop] of shared memory which name is
+    given. Runs in a worker process."""
+
+    shm = shared_memory.SharedMemory(name)
+    try:
+        view = shm.buf.cast("d")
+        if np is not None:
+            np.frombuffer(shm.buf, dtype="d", count=stop)[start:].sort()
+        else:
+            view[start:stop] = array("d", sorted(view[start:stop]))
+        view.release()
+    finally:
+        shm.close()
+
+
+
+def _merge_part(src_name, dst_name, slices, offset):
+    """Merges given sorted slices ((start, stop) pairs) of doubles of shared
+    memory src_name, and writes them from given offset in shared memory
+    dst_name. Runs in a worker process (at Python speed without NumPy)."""
+
+    (src, dst) = (shared_memory.SharedMemory(src_name),
+                  shared_memory.SharedMemory(dst_name))
+    try:
+        size = sum(stop - start for (start, stop) in slices)
+        if np is not None: # a stable sort (timsort) merges sorted runs
+            merged = np.concatenate([
+                    np.frombuffer(src.buf, dtype="d", count=stop)[start:]
+                    for (start, stop) in slices])
+            merged.sort(kind="stable")
+            np.frombuffer(dst.buf, dtype="d",
+                          count=offset + size)[offset:] = merged
+            return
+        (values, output) = (src.buf.cast("d"), dst.buf.cast("d"))
+        output[offset:offset+size] = array("d", heapq.merge(
+                *(values[start:stop] for (start, stop) in slices)))
+        values.release()
+        output.release()
+    finally:
+        src.close()
+        dst.close()
+
+
+
+def parallel_sort(values, workers=None):
+    """Returns given floats (any iterable, or an array('d')) sorted in a new
+    array('d'), using given number of worker processes."""
+
+    workers = workers or os.cpu_count()
+    if not isinstance(values, array) or values.typecode != "d":
+        values = array("d", values)
+    size = len(values)
+    if size == 0:
+        return array("d")
+    nbytes = size * values.itemsize
+    src = shared_memory.SharedMemory(create=True, size=nbytes)
+    dst = shared_memory.SharedMemory(create=True, size=nbytes)
+    try:
+        src.buf[:nbytes] = memoryview(values).cast("B") # raw copy
+        bounds = [size * idx // workers for idx in range(workers + 1)]
+        chunks = list(zip(bounds, bounds[1:]))
+        with ProcessPoolExecutor(workers) as pool:
+            for future in [pool.submit(_sort_chunk, src.name, start, stop)
+                           for (start, stop) in chunks]:
+                future.result() # raises exceptions of workers
+
+            # Splitters: quantiles of the samples of all chunks
+            view = src.buf.cast("d")
+            samples = sorted(view[start + (stop - start) * idx // workers]
+                             for (start, stop) in chunks if stop > start
+                             for idx in range(workers))
+            splitters = [samples[len(samples) * idx // workers]
+                         for idx in range(1, workers)]
+            cuts = [[start] + [bisect.bisect_left(view, splitter, start, stop)
+                               for splitter in splitters] + [stop]
+                    for (start, stop) in chunks] # cut positions by chunk
+            view.release()
+
+            futures = []
+            offset = 0
+            for part in range(workers):
+                slices = [(chunk[part], chunk[part + 1]) for chunk in cuts]
+                futures.append(pool.submit(_merge_part, src.name, dst.name,
+                                           slices, offset))
+                offset += sum(stop - start for (start, stop) in slices)
+            for future in futures:
+                future.result()
+
+        result = array("d")
+        result.frombytes(dst.buf[:nbytes]) # raw copy
+        return result
+    finally:
+        for shm in (src, dst):
+            shm.close()
+            shm.unlink()
+
+
+
+if __name__ == "__main__": # see EXTERNAL MERGE SORT
+    mt.headprint("PARALLEL SORT")
+
+    mt.stepprint("Sort numbers")
+
+    print("Original state:", num_list)
+    print("Output of parallel_sort(list) :", parallel_sort(num_list, 2))
+    print("Output of parallel_sort(tuple) :",
+          parallel_sort((5., 3., 4., 1., 2.), 3))
+
+    mt.stepprint("Scaling")
+
+    floats = array("d", (random.random() for _ in range(10**6)))
+    expected = array("d", sorted(floats))
+    duration = timeit.timeit(lambda: sorted(floats), number=1)
+    print("Sorting {} floats (sorted): {:.3f} s".format(len(floats),
+                                                        duration))
+    for workers in (1, 2, 4, 8, 16):
+        if workers > os.cpu_count():
+            break
+        assert parallel_sort(floats, workers) == expected
+        duration = timeit.timeit(lambda: parallel_sort(floats, workers),
+                                 number=1)
+        print("Sorting {} floats (parallel_sort, {} workers): {:.3f} s"
+              .format(len(floats), workers, duration))
+
+
+
+# CONCLUSIONS:
+# - Shared memory lets processes work on the same data without pickling it.
+# - A sort can be split into independent sorts of chunks, then independent
+#   merges of parts delimited by splitters.
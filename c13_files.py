@@ -131,4 +131,187 @@ print(data)
 # CONCLUSIONS:
 # 1/ Binary file opened in 'wb' or 'rb' mode have type '_io.BufferedReader'.
 # 2/ We need to create Picker and Unpickler objects to configure the
-#    serialization protocol before we can dump or load objects.
\ No newline at end of file
+#    serialization protocol before we can dump or load objects.
+
+
+#%% ============================== CHUNKED I/O ================================
+
+# read() loads a whole file in memory, and write() handles one string per
+# call: neither scales to huge files, or to a large number of lines.
+# - iter_chunks() yields chunks of a given size (text or binary), and sets
+#   the size of the buffer of the file object to the same value.
+# - iter_readinto() reads a binary file into a preallocated bytearray, with
+#   readinto(): no new bytes object is created for each chunk. It yields a
+#   memoryview on the same buffer each time, which must be consumed (or
+#   copied) before next chunk.
+# - write_lines() writes lines by batches, through a buffer of a given size.
+#   Each batch is joined and written with a single call: on a text file,
+#   writelines() encodes and writes each line separately.
+
+
+import collections
+import functools
+import itertools
+import os
+import tempfile
+import timeit
+
+
+mt.headprint("CHUNKED I/O")
+
+
+def iter_chunks(path, size=2**16, binary=True, encoding="utf-8"):
+    """Yields content of file at given path, by chunks of given size (bytes
+    in binary mode, characters in text mode)."""
+
+    if size < 1: # check input
+        raise ValueError("size must be positive")
+    if binary:
+        myfile = open(path, "rb", buffering=size)
+    else:
+        myfile = open(path, "r", buffering=size, encoding=encoding)
+    with myfile:
+        yield from iter(functools.partial(myfile.read, size),
+                        b"" if binary else "")
+
+
+def iter_readinto(path, buffer):
+    """Yields content of binary file at given path, read into given bytearray
+    (or other writable buffer), as memoryviews on the filled part of the
+    buffer. Each chunk is overwritten by the next one."""
+
+    view = memoryview(buffer)
+    if not len(view): # check input
+        raise ValueError("buffer must not be empty")
+    with open(path, "rb", buffering=0) as myfile: # no buffer: read directly
+        readinto = myfile.readinto
+        while True:
+            count = readinto(view)
+            if not count:
+                return
+            yield view[:count]
+
+
+def write_lines(path, lines, batch=2**12, buffering=2**16, binary=False,
+                encoding="utf-8"):
+    """Writes given lines (str, or bytes in binary mode, with their line
+    endings) to file at given path, by batches of given number of lines,
+    through a buffer of given size. Returns number of lines written."""
+
+    if batch < 1: # check input
+        raise ValueError("batch must be positive")
+    if binary:
+        myfile = open(path, "wb", buffering=buffering)
+    else:
+        myfile = open(path, "w", buffering=buffering, encoding=encoding)
+    join = (b"" if binary else "").join
+    count = 0
+    with myfile:
+        if isinstance(lines, (list, tuple)): # slicing is cheaper
+            for start in range(0, len(lines), batch):
+                myfile.write(join(lines[start:start+batch]))
+            return len(lines)
+        lines = iter(lines)
+        while True:
+            chunk = list(itertools.islice(lines, batch))
+            if not chunk:
+                return count
+            myfile.write(join(chunk))
+            count += len(chunk)
+
+
+TMPDIR = tempfile.TemporaryDirectory()
+PATH = os.path.join(TMPDIR.name, "chunkfile")
+LINES = ["line {:>7} of a file read by chunks\n".format(idx) for idx
+         in range(200000)]
+
+mt.stepprint("Write and read back a file")
+print("Written lines:", write_lines(PATH, LINES))
+with open(PATH, "rb") as myfile:
+    CONTENT = myfile.read()
+print("File size:", len(CONTENT), "bytes")
+assert b"".join(iter_chunks(PATH, 1000)) == CONTENT
+assert "".join(iter_chunks(PATH, 1000, binary=False)) == "".join(LINES)
+assert b"".join(bytes(view) for view # copy: the buffer is reused
+                in iter_readinto(PATH, bytearray(1000))) == CONTENT
+chunks = list(iter_readinto(PATH, bytearray(1000)))
+print("Chunks from readinto() share the same buffer:",
+      chunks[0].obj is chunks[-1].obj)
+assert write_lines(PATH, map(str.encode, LINES), batch=7, binary=True) \
+       == len(LINES)
+assert "".join(iter_chunks(PATH, binary=False)) == "".join(LINES)
+
+
+mt.stepprint("Benchmark reads (ms per file)")
+
+
+def consume(chunks):
+    """Consumes given iterable at C speed (see ITERATORS)."""
+    collections.deque(chunks, maxlen=0)
+
+
+def read_whole(path):
+    """Reads given binary file at once, and closes it."""
+    with open(path, "rb") as myfile:
+        return myfile.read()
+
+
+SIZES = (2**10, 2**12, 2**16, 2**20)
+print("{:>10} {:>10} {:>10} {:>10} {:>10}".format("size", "read()", "rb",
+                                                    "r", "readinto"))
+whole = min(timeit.repeat(lambda: read_whole(PATH), number=10,
+                          repeat=3)) / 10
+for size in SIZES:
+    times = [whole]
+    for function in (lambda: consume(iter_chunks(PATH, size)),
+                     lambda: consume(iter_chunks(PATH, size, binary=False)),
+                     lambda: consume(iter_readinto(PATH, bytearray(size)))):
+        times.append(min(timeit.repeat(function, number=10, repeat=3)) / 10)
+    print("{:>10} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+        size, *(duration * 1000 for duration in times)))
+
+
+mt.stepprint("Benchmark writes (ms per file)")
+
+
+def write_each(path, lines, buffering):
+    """Writes given lines one by one."""
+    with open(path, "w", buffering=buffering) as myfile:
+        for line in lines:
+            myfile.write(line)
+
+
+def write_all(path, lines, buffering):
+    """Writes given lines with a single call to writelines()."""
+    with open(path, "w", buffering=buffering) as myfile:
+        myfile.writelines(lines)
+
+
+BLINES = [line.encode() for line in LINES]
+print("{:>10} {:>10} {:>12} {:>10} {:>10} {:>10}".format(
+    "buffer", "write()", "writelines()", "batch=64", "batch=4096", "binary"))
+for size in SIZES:
+    times = []
+    for function in (lambda: write_each(PATH, LINES, size),
+                     lambda: write_all(PATH, LINES, size),
+                     lambda: write_lines(PATH, LINES, 64, size),
+                     lambda: write_lines(PATH, LINES, 2**12, size),
+                     lambda: write_lines(PATH, BLINES, 2**12, size, True)):
+        times.append(min(timeit.repeat(function, number=3, repeat=3)) / 3)
+    print("{:>10} {:>10.2f} {:>12.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+        size, *(duration * 1000 for duration in times)))
+
+TMPDIR.cleanup()
+
+
+# CONCLUSIONS:
+# 1/ Chunks of a few kilobytes cost a Python call each: from 64 KB on, reading
+#    by chunks is about as fast as reading the whole file, in bounded memory.
+# 2/ Text mode decodes (and translates line endings): with large chunks, it
+#    is about twice slower than binary mode.
+# 3/ readinto() with a preallocated buffer avoids allocating a new bytes
+#    object for each chunk, which matters for small chunks.
+# 4/ Joining lines by batches and writing each batch with one call is about
+#    twice faster than a write() per line, and than writelines() (which
+#    handles lines one by one). The buffer size matters little once it
+#    exceeds a few kilobytes.